@@ -0,0 +1,258 @@
+"""
+Бенчмарк скетчей: скорость, память и точность на сетке параметров
+
+    python benchmark.py run --output before.json
+    python benchmark.py run --sketch BloomFilterNHash --set-sizes 5000 5000000 --output after.json
+    python benchmark.py compare before.json after.json
+
+Данные порождаются функцией utils.gen_uniq_seq: один файл с ключами, которые кладутся в скетч,
+и второй - с заведомо отсутствующими ключами для подсчёта ложноположительных срабатываний.
+Каждый замер идёт в отдельном процессе, чтобы пиковая память одного скетча не влияла на другие.
+Ключи случайные, поэтому для сравнения точности двух запусков их стоит породить один раз: --data-dir
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from blocked_bloom_filter import BlockedBloomFilter
+from bloom_filter import BloomFilter
+from bloom_filter_n_hash import BloomFilterNHash
+from counter_bloom_filter import ConutersBloomFilter
+from cuckoo_filter import CuckooFilter
+from csv_keys import read_key_batches
+from hyper_log_log import HyperLogLog
+from hyper_log_log_plus_plus import HyperLogLogPlusPlus
+from scalable_bloom_filter import ScalableBloomFilter
+from sketch_memory import sketch_nbytes
+from utils import gen_uniq_seq
+
+
+# Название скетча -> (конструктор по параметрам, сетка параметров)
+SKETCHES = {
+    'BloomFilter': (
+        lambda p: BloomFilter(p['filter_size']),
+        [{'filter_size': size} for size in (1024, 64000, 16000000)],
+    ),
+    'BloomFilterNHash': (
+        lambda p: BloomFilterNHash(p['hash_num'], p['filter_size']),
+        [{'hash_num': k, 'filter_size': size} for k in (1, 2, 3, 4) for size in (64000, 16000000)],
+    ),
+    # Та же сетка, что у BloomFilterNHash, чтобы сравнивать fp_rate и задержку проверки
+    'BlockedBloomFilter': (
+        lambda p: BlockedBloomFilter(p['hash_num'], p['filter_size']),
+        [{'hash_num': k, 'filter_size': size} for k in (1, 2, 3, 4) for size in (64000, 16000000)],
+    ),
+    'ConutersBloomFilter': (
+        lambda p: ConutersBloomFilter(p['hash_num'], p['filter_size'], p['counter_num'], counter_bits=p.get('counter_bits')),
+        [{'hash_num': k, 'filter_size': 1600000, 'counter_num': c} for k in (1, 3) for c in (1, 15, 60000)]
+        + [{'hash_num': k, 'filter_size': 1600000, 'counter_num': 60000, 'counter_bits': 4} for k in (1, 3)],
+    ),
+    'CuckooFilter': (
+        lambda p: CuckooFilter(p['capacity'], p['fingerprint_bits']),
+        [{'capacity': 1000000, 'fingerprint_bits': bits} for bits in (8, 16)],
+    ),
+    'ScalableBloomFilter': (
+        lambda p: ScalableBloomFilter(p['initial_capacity'], p['target_fp']),
+        [{'initial_capacity': capacity, 'target_fp': 0.01} for capacity in (1000, 100000)],
+    ),
+    'HyperLogLog': (
+        lambda p: HyperLogLog(p['b'], p['hash_size']),
+        [{'b': b, 'hash_size': hash_size} for b in (6, 10, 14) for hash_size in (32, 64)],
+    ),
+    'HyperLogLogPlusPlus': (
+        lambda p: HyperLogLogPlusPlus(p['b']),
+        [{'b': b} for b in (6, 10, 14)],
+    ),
+}
+
+DEFAULT_SET_SIZES = [5000, 500000]
+
+# Кол-во отдельных вызовов get для замера задержки проверки одного ключа
+LATENCY_KEYS_NUM = 10000
+
+# Метрики, которые при росте означают улучшение; остальные - ухудшение
+HIGHER_IS_BETTER = {'put_keys_per_sec', 'get_keys_per_sec', 'est_size_per_sec'}
+# Абсолютный допуск для метрик-долей, чтобы шум на почти нулевых значениях не считался регрессией
+ABS_TOLERANCE = {'fp_rate': 1e-3, 'rel_error': 1e-2}
+
+
+def _peak_rss_bytes() -> int:
+    # На Linux ru_maxrss в килобайтах, на macOS - в байтах
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak_rss if sys.platform == 'darwin' else peak_rss * 1024
+
+
+def run_case(sketch_name: str, params: dict, keys_file: str, absent_file: str, set_size: int) -> dict:
+    keys_batches = list(read_key_batches(keys_file))
+    absent_batches = list(read_key_batches(absent_file))
+    rss_before = _peak_rss_bytes()
+
+    make_sketch, _ = SKETCHES[sketch_name]
+    sketch = make_sketch(params)
+    is_filter = hasattr(sketch, 'put_many')
+
+    start = time.perf_counter()
+    for keys_batch in keys_batches:
+        if is_filter:
+            sketch.put_many(keys_batch)
+        else:
+            sketch.add_many(keys_batch)
+    put_time = time.perf_counter() - start
+
+    result = {
+        'sketch': sketch_name,
+        'params': params,
+        'set_size': set_size,
+        'put_keys_per_sec': set_size / put_time,
+        'sketch_bytes': sketch_nbytes(sketch),
+        'bytes_per_element': sketch_nbytes(sketch) / set_size,
+    }
+
+    if is_filter:
+        start = time.perf_counter()
+        for keys_batch in keys_batches:
+            sketch.get_many(keys_batch)
+        result['get_keys_per_sec'] = set_size / (time.perf_counter() - start)
+        # Задержка одиночной проверки отсутствующего ключа - путь запроса онлайн-сервиса
+        latency_keys = [key for absent_batch in absent_batches for key in absent_batch][:LATENCY_KEYS_NUM]
+        start = time.perf_counter()
+        for key in latency_keys:
+            sketch.get(key)
+        result['get_one_ns'] = (time.perf_counter() - start) / len(latency_keys) * 1e9
+        fp_count = sum(int(sketch.get_many(absent_batch).sum()) for absent_batch in absent_batches)
+        result['fp_rate'] = fp_count / set_size
+    else:
+        est_repeats = 10
+        start = time.perf_counter()
+        for _ in range(est_repeats):
+            est_size = sketch.est_size()
+        result['est_size_per_sec'] = est_repeats / (time.perf_counter() - start)
+        result['rel_error'] = abs(float(est_size) - set_size) / set_size
+
+    result['peak_rss_bytes'] = _peak_rss_bytes()
+    result['peak_rss_delta_bytes'] = result['peak_rss_bytes'] - rss_before
+    return result
+
+
+def _gen_keys_file(data_dir: str, name: str, set_size: int) -> str:
+    file_name = os.path.join(data_dir, f'{name}_{set_size}.txt')
+    if not os.path.exists(file_name):
+        # gen_uniq_seq печатает прогресс - в выводе бенчмарка он не нужен
+        with contextlib.redirect_stdout(io.StringIO()):
+            gen_uniq_seq(file_name, set_size)
+    return file_name
+
+
+def run(sketch_names: list[str], set_sizes: list[int], data_dir: str) -> dict:
+    results = []
+    for set_size in set_sizes:
+        keys_file = _gen_keys_file(data_dir, 'keys', set_size)
+        absent_file = _gen_keys_file(data_dir, 'absent', set_size)
+        for sketch_name in sketch_names:
+            _, params_grid = SKETCHES[sketch_name]
+            for params in params_grid:
+                # Отдельный процесс на замер - иначе ru_maxrss покажет максимум по всем предыдущим скетчам
+                with ProcessPoolExecutor(max_workers=1) as executor:
+                    result = executor.submit(run_case, sketch_name, params, keys_file, absent_file, set_size).result()
+                print(json.dumps(result), file=sys.stderr)
+                results.append(result)
+
+    return {
+        'meta': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'results': results,
+    }
+
+
+def compare(old_run: dict, new_run: dict, threshold: float) -> list[dict]:
+    """ Возвращает метрики, которые ухудшились больше чем на threshold (доля) """
+    def case_key(result):
+        return result['sketch'], json.dumps(result['params'], sort_keys=True), result['set_size']
+
+    old_results = {case_key(result): result for result in old_run['results']}
+    regressions = []
+    for new_result in new_run['results']:
+        old_result = old_results.get(case_key(new_result))
+        if old_result is None:
+            continue
+        for metric, new_value in new_result.items():
+            if metric not in old_result or not isinstance(new_value, (int, float)) or metric == 'set_size':
+                continue
+            old_value = old_result[metric]
+            if metric in HIGHER_IS_BETTER:
+                is_worse = new_value < old_value * (1 - threshold)
+            else:
+                is_worse = new_value > old_value * (1 + threshold) + ABS_TOLERANCE.get(metric, 0)
+            if is_worse:
+                regressions.append({
+                    'sketch': new_result['sketch'],
+                    'params': new_result['params'],
+                    'set_size': new_result['set_size'],
+                    'metric': metric,
+                    'old': old_value,
+                    'new': new_value,
+                })
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help='measure sketches and write results as JSON')
+    run_parser.add_argument('--sketch', nargs='+', choices=list(SKETCHES), default=list(SKETCHES))
+    run_parser.add_argument('--set-sizes', nargs='+', type=int, default=DEFAULT_SET_SIZES)
+    run_parser.add_argument('--data-dir', help='directory to keep generated key files between runs')
+    run_parser.add_argument('--output', help='JSON file for results (stdout by default)')
+
+    compare_parser = subparsers.add_parser('compare', help='compare two runs and report regressions')
+    compare_parser.add_argument('old')
+    compare_parser.add_argument('new')
+    compare_parser.add_argument('--threshold', type=float, default=0.1, help='allowed relative degradation')
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'run':
+        with contextlib.ExitStack() as stack:
+            data_dir = args.data_dir or stack.enter_context(tempfile.TemporaryDirectory())
+            os.makedirs(data_dir, exist_ok=True)
+            report = run(args.sketch, args.set_sizes, data_dir)
+        report_json = json.dumps(report, indent=2)
+        if args.output:
+            with open(args.output, 'wt') as f:
+                f.write(report_json)
+        else:
+            print(report_json)
+        return 0
+
+    with open(args.old) as f:
+        old_run = json.load(f)
+    with open(args.new) as f:
+        new_run = json.load(f)
+    regressions = compare(old_run, new_run, args.threshold)
+    for regression in regressions:
+        print(
+            f"{regression['sketch']} {regression['params']} set_size={regression['set_size']}: "
+            f"{regression['metric']} {regression['old']:.6g} -> {regression['new']:.6g}"
+        )
+    print(f'{len(regressions)} regression(s)')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,70 @@
+import numpy as np
+
+
+# Кол-во единиц в каждом возможном байте - для NumPy без np.bitwise_count
+_BYTE_POPCOUNT = np.array([bin(byte).count('1') for byte in range(256)], dtype=np.uint8)
+
+
+def popcount(cells: np.ndarray) -> int:
+    """ Считает кол-во единичных битов в массиве беззнаковых целых """
+    if hasattr(np, 'bitwise_count'):
+        return int(np.bitwise_count(cells).sum(dtype=np.int64))
+    return int(_BYTE_POPCOUNT[np.ascontiguousarray(cells).view(np.uint8)].sum(dtype=np.int64))
+
+
+def check_writeable(array: np.ndarray):
+    if not array.flags.writeable:
+        raise ValueError('assignment destination is read-only')
+
+
+def ufunc_at(ufunc: np.ufunc, array: np.ndarray, indexes: np.ndarray, values):
+    """
+    ufunc.at с проверкой флага writeable
+
+    Сам ufunc.at флаг не проверяет и на массиве только для чтения (np.memmap в режиме 'r') роняет процесс
+    """
+    check_writeable(array)
+    ufunc.at(array, indexes, values)
+
+
+def bit_length(values: np.ndarray) -> np.ndarray:
+    """
+    Векторизованный аналог int.bit_length для uint64
+
+    Показатель np.frexp равен длине числа в битах, но float64 точен только до 2**53,
+    поэтому старшие и младшие 32 бита считаются отдельно
+    """
+    values = np.asarray(values, dtype=np.uint64)
+    high = (values >> np.uint64(32)).astype(np.float64)
+    low = (values & np.uint64(0xFFFFFFFF)).astype(np.float64)
+    return np.where(high > 0, np.frexp(high)[1] + 32, np.frexp(low)[1]).astype(np.int64)
+
+
+def varint_encode(values: np.ndarray) -> bytes:
+    """ Кодирует uint64 в LEB128: по 7 бит в байте, старший бит - признак продолжения """
+    values = np.asarray(values, dtype=np.uint64)
+    bytes_num = np.maximum(1, (bit_length(values) + 6) // 7)
+    starts = np.cumsum(bytes_num) - bytes_num
+    encoded = np.zeros(int(bytes_num.sum()), dtype=np.uint8)
+    for byte_idx in range(int(bytes_num.max(initial=0))):
+        has_byte = bytes_num > byte_idx
+        chunk = (values[has_byte] >> np.uint64(7 * byte_idx)) & np.uint64(0x7F)
+        is_continued = (bytes_num[has_byte] > byte_idx + 1).astype(np.uint64) << np.uint64(7)
+        encoded[starts[has_byte] + byte_idx] = chunk | is_continued
+    return encoded.tobytes()
+
+
+def varint_decode(buffer: bytes) -> np.ndarray:
+    """ Обратное к varint_encode """
+    encoded = np.frombuffer(buffer, dtype=np.uint8)
+    if not len(encoded):
+        return np.zeros(0, dtype=np.uint64)
+    is_last = (encoded & 0x80) == 0
+    ends = np.flatnonzero(is_last)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    # Номер байта внутри своего числа
+    value_idxes = np.cumsum(is_last) - is_last
+    byte_idxes = np.arange(len(encoded)) - starts[value_idxes]
+    chunks = (encoded & 0x7F).astype(np.uint64) << (7 * byte_idxes).astype(np.uint64)
+    # Куски числа не пересекаются по битам, поэтому сумма равна побитовому ИЛИ
+    return np.add.reduceat(chunks, starts)
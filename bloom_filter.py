@@ -1,31 +1,71 @@
+from copy import deepcopy
+
 import numpy as np
-import mmh3
+
+from bit_array import check_writeable, popcount, ufunc_at
+from hashing import Keys, hashed_keys, key_positions
 
 
 class BloomFilter:
-    def __init__(self, filter_size: int):
+    @classmethod
+    def from_capacity(cls, expected_n: int, target_fp: float, seed: int = 0) -> 'BloomFilter':
+        # С одним хешем доля ложных срабатываний 1 - exp(-n / m)
+        if expected_n <= 0 or not 0 < target_fp < 1:
+            raise ValueError(f'Expected positive expected_n and target_fp in (0, 1), got {expected_n}, {target_fp}')
+        filter_size = int(np.ceil(-expected_n / np.log(1 - target_fp)))
+        return cls(filter_size=filter_size, seed=seed)
+
+    def __init__(self, filter_size: int, seed: int = 0):
         self.filter_size = filter_size
-        self._dtype_bit_size = 8
+        self.seed = seed
+        self._dtype_bit_size = 64
         num_cells = int(np.ceil(filter_size / self._dtype_bit_size))
-        self.is_hashed = np.zeros(num_cells, dtype=np.uint8)
+        self.is_hashed = np.zeros(num_cells, dtype=np.uint64)
+        # Кол-во единичных битов поддерживается при вставке, чтобы size() был O(1)
+        self._ones_count = 0
 
     def _insert_bit(self, pos: int):
+        check_writeable(self.is_hashed)
         cell_idx = pos // self._dtype_bit_size
         bit_idx = pos % self._dtype_bit_size
-        logic_bit = 1 << bit_idx
+        logic_bit = np.uint64(1) << np.uint64(bit_idx)
 
+        if not self.is_hashed[cell_idx] & logic_bit:
+            self._ones_count += 1
         self.is_hashed[cell_idx] = np.bitwise_or(self.is_hashed[cell_idx], logic_bit)
 
     def _get_bit(self, pos: int) -> bool:
         cell_idx = pos // self._dtype_bit_size
         bit_idx = pos % self._dtype_bit_size
-        logic_bit = 1 << bit_idx
+        logic_bit = np.uint64(1) << np.uint64(bit_idx)
 
         tagret_bit = np.bitwise_and(self.is_hashed[cell_idx], logic_bit)
         return tagret_bit > 0
 
+    def _insert_bits(self, positions: np.ndarray):
+        cell_idxes = positions // self._dtype_bit_size
+        bit_idxes = (positions % self._dtype_bit_size).astype(np.uint64)
+        logic_bits = np.left_shift(np.uint64(1), bit_idxes)
+        # Прирост единиц считаем по затронутым ячейкам до и после вставки
+        touched_cells = np.unique(cell_idxes)
+        ones_before = popcount(self.is_hashed[touched_cells])
+        # Повторяющиеся ячейки в батче обрабатываются корректно только через .at
+        ufunc_at(np.bitwise_or, self.is_hashed, cell_idxes, logic_bits)
+        self._ones_count += popcount(self.is_hashed[touched_cells]) - ones_before
+
+    def _recount_ones(self):
+        self._ones_count = popcount(self.is_hashed)
+
+    def _get_bits(self, positions: np.ndarray) -> np.ndarray:
+        cell_idxes = positions // self._dtype_bit_size
+        bit_idxes = (positions % self._dtype_bit_size).astype(np.uint64)
+        return ((self.is_hashed[cell_idxes] >> bit_idxes) & np.uint64(1)).astype(bool)
+
     def hash(self, string: str) -> int:
-        return mmh3.hash(string) % self.filter_size
+        return key_positions(string, 1, self.filter_size, self.seed)[0]
+
+    def hash_many(self, strings: Keys) -> np.ndarray:
+        return hashed_keys(strings, self.seed).positions(1, self.filter_size)[:, 0]
 
     def put(self, string: str):
         string_hash = self.hash(string)
@@ -35,5 +75,52 @@ class BloomFilter:
         string_hash = self.hash(string)
         return self._get_bit(string_hash)
 
+    def put_many(self, strings: Keys):
+        string_hashes = self.hash_many(strings)
+        self._insert_bits(string_hashes)
+
+    def get_many(self, strings: Keys) -> np.ndarray:
+        string_hashes = self.hash_many(strings)
+        return self._get_bits(string_hashes)
+
     def size(self) -> int:
-        return sum(bits.bit_count() for bits in self.is_hashed)
\ No newline at end of file
+        return self._ones_count
+
+    def copy(self) -> 'BloomFilter':
+        return deepcopy(self)
+
+    def _check_compatible(self, other: 'BloomFilter'):
+        if not isinstance(other, BloomFilter):
+            raise TypeError(f'Cannot combine BloomFilter with {type(other).__name__}')
+        for attr in ('filter_size', 'seed'):
+            if getattr(self, attr) != getattr(other, attr):
+                raise ValueError(f'Incompatible filters: {attr} {getattr(self, attr)} != {getattr(other, attr)}')
+
+    def merge(self, other: 'BloomFilter') -> 'BloomFilter':
+        """ Объединение на месте: ключ есть в результате, если он был хотя бы в одном фильтре """
+        self._check_compatible(other)
+        np.bitwise_or(self.is_hashed, other.is_hashed, out=self.is_hashed)
+        self._recount_ones()
+        return self
+
+    def intersect(self, other: 'BloomFilter') -> 'BloomFilter':
+        """
+        Пересечение на месте. Ложноположительных срабатываний может быть больше,
+        чем у фильтра, построенного только по общим ключам
+        """
+        self._check_compatible(other)
+        np.bitwise_and(self.is_hashed, other.is_hashed, out=self.is_hashed)
+        self._recount_ones()
+        return self
+
+    def __or__(self, other: 'BloomFilter') -> 'BloomFilter':
+        return self.copy().merge(other)
+
+    def __ior__(self, other: 'BloomFilter') -> 'BloomFilter':
+        return self.merge(other)
+
+    def __and__(self, other: 'BloomFilter') -> 'BloomFilter':
+        return self.copy().intersect(other)
+
+    def __iand__(self, other: 'BloomFilter') -> 'BloomFilter':
+        return self.intersect(other)
\ No newline at end of file
@@ -1,39 +1,85 @@
+from copy import deepcopy
 from typing import Generator
 
 import numpy as np
-import mmh3
+
+from bit_array import check_writeable, popcount, ufunc_at
+from hashing import Keys, hashed_keys, key_positions
+
+
+def optimal_bloom_params(expected_n: int, target_fp: float) -> tuple[int, int]:  # filter_size, hash_num
+    """ Размер фильтра и кол-во хешей, при которых expected_n ключей дают долю ложных срабатываний target_fp """
+    if expected_n <= 0 or not 0 < target_fp < 1:
+        raise ValueError(f'Expected positive expected_n and target_fp in (0, 1), got {expected_n}, {target_fp}')
+    filter_size = int(np.ceil(-expected_n * np.log(target_fp) / np.log(2) ** 2))
+    hash_num = max(1, int(round(filter_size / expected_n * np.log(2))))
+    return filter_size, hash_num
 
 
 class BloomFilterNHash:
+    @classmethod
+    def from_capacity(cls, expected_n: int, target_fp: float, seed: int = 0) -> 'BloomFilterNHash':
+        filter_size, hash_num = optimal_bloom_params(expected_n, target_fp)
+        return cls(hash_num=hash_num, filter_size=filter_size, seed=seed)
+
     def __init__(
             self, 
             hash_num: int, 
-            filter_size: int
+            filter_size: int,
+            seed: int = 0
             ):
         self.hash_num = hash_num
         self.filter_size = filter_size
-        self._dtype_bit_size = 8
+        self.seed = seed
+        self._dtype_bit_size = 64
         num_cells = int(np.ceil(filter_size / self._dtype_bit_size))
-        self.is_hashed = np.zeros(num_cells, dtype=np.uint8)
+        self.is_hashed = np.zeros(num_cells, dtype=np.uint64)
+        # Кол-во единичных битов поддерживается при вставке, чтобы size() был O(1)
+        self._ones_count = 0
 
     def _insert_bit(self, pos: int):
+        check_writeable(self.is_hashed)
         cell_idx = pos // self._dtype_bit_size
         bit_idx = pos % self._dtype_bit_size
-        logic_bit = 1 << bit_idx
+        logic_bit = np.uint64(1) << np.uint64(bit_idx)
 
+        if not self.is_hashed[cell_idx] & logic_bit:
+            self._ones_count += 1
         self.is_hashed[cell_idx] = np.bitwise_or(self.is_hashed[cell_idx], logic_bit)
 
     def _get_bit(self, pos: int) -> bool:
         cell_idx = pos // self._dtype_bit_size
         bit_idx = pos % self._dtype_bit_size
-        logic_bit = 1 << bit_idx
+        logic_bit = np.uint64(1) << np.uint64(bit_idx)
 
         tagret_bit = np.bitwise_and(self.is_hashed[cell_idx], logic_bit)
         return tagret_bit > 0
 
+    def _insert_bits(self, positions: np.ndarray):
+        cell_idxes = positions // self._dtype_bit_size
+        bit_idxes = (positions % self._dtype_bit_size).astype(np.uint64)
+        logic_bits = np.left_shift(np.uint64(1), bit_idxes)
+        # Прирост единиц считаем по затронутым ячейкам до и после вставки
+        touched_cells = np.unique(cell_idxes)
+        ones_before = popcount(self.is_hashed[touched_cells])
+        # Повторяющиеся ячейки в батче обрабатываются корректно только через .at
+        ufunc_at(np.bitwise_or, self.is_hashed, cell_idxes, logic_bits)
+        self._ones_count += popcount(self.is_hashed[touched_cells]) - ones_before
+
+    def _recount_ones(self):
+        self._ones_count = popcount(self.is_hashed)
+
+    def _get_bits(self, positions: np.ndarray) -> np.ndarray:
+        cell_idxes = positions // self._dtype_bit_size
+        bit_idxes = (positions % self._dtype_bit_size).astype(np.uint64)
+        return ((self.is_hashed[cell_idxes] >> bit_idxes) & np.uint64(1)).astype(bool)
+
     def hash(self, string: str) -> Generator:
-        for bf_seed in range(0, self.hash_num):
-            yield mmh3.hash(string, seed=bf_seed) % self.filter_size
+        yield from key_positions(string, self.hash_num, self.filter_size, self.seed)
+
+    def hash_many(self, strings: Keys) -> np.ndarray:
+        # Позиции формы (кол-во ключей, hash_num)
+        return hashed_keys(strings, self.seed).positions(self.hash_num, self.filter_size)
 
     def put(self, string: str):
         string_hashes = self.hash(string)
@@ -47,6 +93,53 @@ class BloomFilterNHash:
                 return False
         return True
 
+    def put_many(self, strings: Keys):
+        string_hashes = self.hash_many(strings)
+        self._insert_bits(string_hashes.ravel())
+
+    def get_many(self, strings: Keys) -> np.ndarray:
+        string_hashes = self.hash_many(strings)
+        # Ключ есть в фильтре, только если выставлены все его hash_num битов
+        return self._get_bits(string_hashes).all(axis=1)
+
     def size(self) -> int:
-        num_bits = sum(bits.bit_count() for bits in self.is_hashed)
-        return num_bits/self.hash_num
\ No newline at end of file
+        return self._ones_count/self.hash_num
+
+    def copy(self) -> 'BloomFilterNHash':
+        return deepcopy(self)
+
+    def _check_compatible(self, other: 'BloomFilterNHash'):
+        if not isinstance(other, BloomFilterNHash):
+            raise TypeError(f'Cannot combine BloomFilterNHash with {type(other).__name__}')
+        for attr in ('hash_num', 'filter_size', 'seed'):
+            if getattr(self, attr) != getattr(other, attr):
+                raise ValueError(f'Incompatible filters: {attr} {getattr(self, attr)} != {getattr(other, attr)}')
+
+    def merge(self, other: 'BloomFilterNHash') -> 'BloomFilterNHash':
+        """ Объединение на месте: ключ есть в результате, если он был хотя бы в одном фильтре """
+        self._check_compatible(other)
+        np.bitwise_or(self.is_hashed, other.is_hashed, out=self.is_hashed)
+        self._recount_ones()
+        return self
+
+    def intersect(self, other: 'BloomFilterNHash') -> 'BloomFilterNHash':
+        """
+        Пересечение на месте. Ложноположительных срабатываний может быть больше,
+        чем у фильтра, построенного только по общим ключам
+        """
+        self._check_compatible(other)
+        np.bitwise_and(self.is_hashed, other.is_hashed, out=self.is_hashed)
+        self._recount_ones()
+        return self
+
+    def __or__(self, other: 'BloomFilterNHash') -> 'BloomFilterNHash':
+        return self.copy().merge(other)
+
+    def __ior__(self, other: 'BloomFilterNHash') -> 'BloomFilterNHash':
+        return self.merge(other)
+
+    def __and__(self, other: 'BloomFilterNHash') -> 'BloomFilterNHash':
+        return self.copy().intersect(other)
+
+    def __iand__(self, other: 'BloomFilterNHash') -> 'BloomFilterNHash':
+        return self.intersect(other)
\ No newline at end of file
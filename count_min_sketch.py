@@ -0,0 +1,105 @@
+from copy import deepcopy
+
+import numpy as np
+
+from bit_array import ufunc_at
+from hashing import Keys, hashed_keys, key_positions
+
+
+class CountMinSketch:
+    """
+    Count-Min Sketch: depth строк по width счётчиков, по одному счётчику в строке на ключ
+
+    Оценка кол-ва ключа - минимум его счётчиков - никогда не меньше истинного и с вероятностью
+    не меньше 1 - exp(-depth) превышает его не больше чем на e / width * total.
+    При conservative=True (conservative update) счётчики ключа поднимаются только до новой оценки,
+    а не увеличиваются все - оценки становятся точнее при той же памяти, но слияние скетчей
+    даёт уже только верхнюю оценку
+    """
+    @classmethod
+    def from_error(cls, eps: float, delta: float, conservative: bool = True, seed: int = 0) -> 'CountMinSketch':
+        """ Скетч, у которого ошибка не больше eps * total с вероятностью не меньше 1 - delta """
+        width = int(np.ceil(np.e / eps))
+        depth = int(np.ceil(np.log(1 / delta)))
+        return cls(width=width, depth=depth, conservative=conservative, seed=seed)
+
+    def __init__(self, width: int, depth: int, conservative: bool = True, seed: int = 0):
+        self.width = width
+        self.depth = depth
+        self.conservative = conservative
+        self.seed = seed
+        self.counters = np.zeros((depth, width), dtype=np.uint64)
+        # Сумма всех добавленных кол-в
+        self.total = 0
+
+    @property
+    def _rows(self) -> np.ndarray:
+        return np.arange(self.depth)
+
+    def hash(self, string: str) -> list[int]:
+        return key_positions(string, self.depth, self.width, self.seed)
+
+    def hash_many(self, strings: Keys) -> np.ndarray:
+        # Позиции формы (кол-во ключей, depth): столбец i - номер счётчика в строке i
+        return hashed_keys(strings, self.seed).positions(self.depth, self.width)
+
+    def put(self, string: str, count: int = 1):
+        positions = self.hash(string)
+        counts = self.counters[self._rows, positions]
+        if self.conservative:
+            np.maximum(counts, counts.min() + np.uint64(count), out=counts)
+        else:
+            counts += np.uint64(count)
+        self.counters[self._rows, positions] = counts
+        self.total += count
+
+    def put_many(self, strings: Keys):
+        positions = self.hash_many(strings)
+        if not len(positions):
+            return
+        # Одинаковые ключи батча схлопываются в одно обновление на их кол-во
+        positions, repeats = np.unique(positions, axis=0, return_counts=True)
+        repeats = repeats.astype(np.uint64)
+        if self.conservative:
+            # Все ключи батча обновляются по оценкам до батча: итог - по-прежнему верхняя оценка
+            targets = self.counters[self._rows, positions].min(axis=1) + repeats
+            for row in self._rows:
+                ufunc_at(np.maximum, self.counters[row], positions[:, row], targets)
+        else:
+            for row in self._rows:
+                ufunc_at(np.add, self.counters[row], positions[:, row], repeats)
+        self.total += int(repeats.sum())
+
+    def count(self, string: str) -> int:
+        return int(self.counters[self._rows, self.hash(string)].min())
+
+    def count_many(self, strings: Keys) -> np.ndarray:
+        positions = self.hash_many(strings)
+        return self.counters[self._rows, positions].min(axis=1, initial=np.iinfo(np.uint64).max)
+
+    def error_bound(self) -> float:
+        """ Превышение оценки над истинным кол-вом, которое не нарушается с вероятностью 1 - exp(-depth) """
+        return np.e / self.width * self.total
+
+    def copy(self) -> 'CountMinSketch':
+        return deepcopy(self)
+
+    def _check_compatible(self, other: 'CountMinSketch'):
+        if not isinstance(other, CountMinSketch):
+            raise TypeError(f'Cannot combine CountMinSketch with {type(other).__name__}')
+        for attr in ('width', 'depth', 'seed'):
+            if getattr(self, attr) != getattr(other, attr):
+                raise ValueError(f'Incompatible sketches: {attr} {getattr(self, attr)} != {getattr(other, attr)}')
+
+    def merge(self, other: 'CountMinSketch') -> 'CountMinSketch':
+        """ Объединение на месте: счётчики складываются """
+        self._check_compatible(other)
+        self.counters += other.counters
+        self.total += other.total
+        return self
+
+    def __or__(self, other: 'CountMinSketch') -> 'CountMinSketch':
+        return self.copy().merge(other)
+
+    def __ior__(self, other: 'CountMinSketch') -> 'CountMinSketch':
+        return self.merge(other)
@@ -0,0 +1,150 @@
+from copy import deepcopy
+
+import numpy as np
+
+from bit_array import ufunc_at
+from hashing import Keys, hashed_keys, key_positions, key_signs
+
+
+class CountSketch:
+    """
+    Count sketch (Fast-AGMS): depth строк по width счётчиков, ключ прибавляет свой знак ±1
+    к одному счётчику в каждой строке
+
+    Скалярное произведение строк двух скетчей - несмещённая оценка размера JOIN двух потоков
+    (суммы произведений кол-в одинаковых ключей) с дисперсией не больше 2 * F2(A) * F2(B) / width,
+    где F2 - сумма квадратов кол-в ключей потока. Медиана по строкам делает большие отклонения
+    маловероятными
+    """
+    def __init__(self, width: int, depth: int = 5, seed: int = 0):
+        self.width = width
+        self.depth = depth
+        self.seed = seed
+        self.counters = np.zeros((depth, width), dtype=np.int64)
+        self.total = 0
+        # Сумма квадратов счётчиков каждой строки (оценка F2 по строке), поддерживается при добавлении ключей
+        self._row_f2 = np.zeros(depth, dtype=np.float64)
+
+    @property
+    def _rows(self) -> np.ndarray:
+        return np.arange(self.depth)
+
+    def hash(self, string: str) -> tuple[list[int], list[int]]:  # positions, signs
+        return (
+            key_positions(string, self.depth, self.width, self.seed),
+            key_signs(string, self.depth, self.seed),
+        )
+
+    def hash_many(self, strings: Keys) -> tuple[np.ndarray, np.ndarray]:  # positions, signs
+        hashed = hashed_keys(strings, self.seed)
+        return hashed.positions(self.depth, self.width), hashed.signs(self.depth)
+
+    def put(self, string: str):
+        positions, signs = self.hash(string)
+        old_counters = self.counters[self._rows, positions]
+        self.counters[self._rows, positions] += signs
+        self._row_f2 += signs * (2 * old_counters + signs)
+        self.total += 1
+
+    def put_many(self, strings: Keys):
+        self._put_hashed(*self.hash_many(strings))
+
+    def _put_hashed(self, positions: np.ndarray, signs: np.ndarray):
+        for row in self._rows:
+            row_positions, row_signs = positions[:, row], signs[:, row]
+            old_counters = self.counters[row].take(row_positions)
+            ufunc_at(np.add, self.counters[row], row_positions, row_signs)
+            # Счётчик с приращением d меняет сумму квадратов на d * (old + new), а d - сумма знаков его ключей,
+            # поэтому повторы позиций в батче группировать не нужно
+            self._row_f2[row] += np.dot(row_signs, old_counters + self.counters[row].take(row_positions))
+        self.total += len(positions)
+
+    def _row_sums(self, positions: np.ndarray, signs: np.ndarray) -> np.ndarray:
+        """ Суммы по ключам знак * счётчик в позиции ключа для каждой строки """
+        return np.array(
+            [np.dot(self.counters[row].take(positions[:, row]), signs[:, row]) for row in self._rows],
+            dtype=np.float64,
+        )
+
+    def count(self, string: str) -> int:
+        """ Несмещённая оценка кол-ва ключа """
+        positions, signs = self.hash(string)
+        return int(np.median(self.counters[self._rows, positions] * signs))
+
+    def _check_compatible(self, other: 'CountSketch'):
+        if not isinstance(other, CountSketch):
+            raise TypeError(f'Cannot combine CountSketch with {type(other).__name__}')
+        for attr in ('width', 'depth', 'seed'):
+            if getattr(self, attr) != getattr(other, attr):
+                raise ValueError(f'Incompatible sketches: {attr} {getattr(self, attr)} != {getattr(other, attr)}')
+
+    def _row_products(self, other: 'CountSketch') -> np.ndarray:
+        self._check_compatible(other)
+        # float64, чтобы суммы произведений больших счётчиков не переполняли int64
+        return np.einsum('ij,ij->i', self.counters.astype(np.float64), other.counters.astype(np.float64))
+
+    def est_join_size(self, other: 'CountSketch') -> float:
+        """ Оценка размера JOIN по ключу: сумма по ключам произведений их кол-в в двух потоках """
+        return float(np.median(self._row_products(other)))
+
+    def est_self_join_size(self) -> float:
+        """ Оценка F2 - суммы квадратов кол-в ключей """
+        return float(np.median(self._row_f2))
+
+    def join_std(self, other: 'CountSketch') -> float:
+        """ Оценка сверху стандартного отклонения одной строки оценки JOIN """
+        self_f2 = max(self.est_self_join_size(), 0)
+        other_f2 = max(other.est_self_join_size(), 0)
+        return float(np.sqrt(2 * self_f2 * other_f2 / self.width))
+
+    def copy(self) -> 'CountSketch':
+        return deepcopy(self)
+
+    def merge(self, other: 'CountSketch') -> 'CountSketch':
+        """ Объединение на месте: счётчики складываются, как если бы потоки шли в один скетч """
+        self._check_compatible(other)
+        self.counters += other.counters
+        self.total += other.total
+        self._row_f2 = np.square(self.counters, dtype=np.float64).sum(axis=1)
+        return self
+
+    def __or__(self, other: 'CountSketch') -> 'CountSketch':
+        return self.copy().merge(other)
+
+    def __ior__(self, other: 'CountSketch') -> 'CountSketch':
+        return self.merge(other)
+
+
+class CountSketchJoin:
+    """
+    Пара count sketch двух таблиц с оценкой размера JOIN, которая поддерживается при добавлении ключей
+
+    Ключ со знаком s в позиции p меняет скалярное произведение строк на s * (счётчик p другого скетча),
+    а F2 строк ведут сами скетчи, поэтому est_join_size и join_std стоят O(depth), а не проход по всем счётчикам,
+    и их можно проверять после каждого батча
+    """
+    def __init__(self, width: int, depth: int = 5, seed: int = 0):
+        self.sketches = (CountSketch(width, depth, seed), CountSketch(width, depth, seed))
+        self._row_products = np.zeros(depth, dtype=np.float64)
+
+    @property
+    def seed(self) -> int:
+        return self.sketches[0].seed
+
+    def put(self, table_idx: int, string: str):
+        self.put_many(table_idx, [string])
+
+    def put_many(self, table_idx: int, strings: Keys):
+        """ Добавляет ключи в скетч таблицы table_idx (0 или 1) """
+        sketch, other = self.sketches[table_idx], self.sketches[1 - table_idx]
+        positions, signs = sketch.hash_many(strings)
+        # Счётчики другого скетча не меняются, так что приращение произведения можно взять до добавления
+        row_sums = other._row_sums(positions, signs)
+        sketch._put_hashed(positions, signs)
+        self._row_products += row_sums
+
+    def est_join_size(self) -> float:
+        return float(np.median(self._row_products))
+
+    def join_std(self) -> float:
+        return self.sketches[0].join_std(self.sketches[1])
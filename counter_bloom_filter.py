@@ -1,30 +1,84 @@
+from copy import deepcopy
+
 import numpy as np
-import mmh3
 
-from typing import Generator
+from typing import Generator, Optional
+
+from bit_array import check_writeable, ufunc_at
+from bloom_filter_n_hash import optimal_bloom_params
+from hashing import Keys, hashed_keys, key_positions
 
 
 class ConutersBloomFilter:
+    @classmethod
+    def from_capacity(
+            cls,
+            expected_n: int,
+            target_fp: float,
+            counter_num: int,
+            count_thres: int = 1,
+            seed: int = 0,
+            counter_bits: Optional[int] = None
+        ) -> 'ConutersBloomFilter':
+        # Доля ложных срабатываний для порога 1 та же, что у обычного фильтра с тем же кол-вом счётчиков
+        filter_size, hash_num = optimal_bloom_params(expected_n, target_fp)
+        return cls(
+            hash_num=hash_num,
+            filter_size=filter_size,
+            counter_num=counter_num,
+            count_thres=count_thres,
+            seed=seed,
+            counter_bits=counter_bits,
+        )
+
     def __init__(
             self, 
             hash_num: int, 
             filter_size: int,
             counter_num: int,
-            count_thres: int = 1
+            count_thres: int = 1,
+            seed: int = 0,
+            counter_bits: Optional[int] = None
         ):
+        """
+        counter_bits - компактный режим: счётчик в ячейке занимает counter_bits битов, а значения
+        от 2**counter_bits - 1 и выше дописываются в разреженную таблицу переполнений.
+        При асимметричном распределении ключей почти все счётчики малы, и память сокращается
+        в counter_num.bit_length() / counter_bits раз; насыщение и порог - те же, что без него
+        """
         self.hash_num = hash_num
         self.filter_size = filter_size
+        self.seed = seed
         self.counter_num = counter_num
         self.count_thres = count_thres
         self._dtype_bit_size = 63
-        self._counter_size = counter_num.bit_length()
+        # Максимальное значение счётчика, на котором он насыщается
+        self._max_count = (1 << counter_num.bit_length()) - 1
+        self._counter_size = min(counter_bits or counter_num.bit_length(), counter_num.bit_length())
         self._counter_in_cell = self._dtype_bit_size // self._counter_size
         self._counter_mask = (1 << self._counter_size) - 1
         num_cells = int(np.ceil(filter_size / self._counter_in_cell))
         self.counter_celled_bits = np.zeros(num_cells, dtype=np.int64)
+        # Таблица переполнений: отсортированные номера счётчиков и превышение над _counter_mask
+        self._overflow_idxes = np.zeros(0, dtype=np.int64)
+        self._overflow_counts = np.zeros(0, dtype=np.int64)
+        # Сумма всех счётчиков и кол-ва ненулевых, насыщенных и не меньших порога счётчиков
+        # поддерживаются при изменении, чтобы size() и статистика заполнения были O(1)
+        self._counters_sum = 0
+        self._nonzero_count = 0
+        self._saturated_count = 0
+        self._thres_count = 0
+
+    @property
+    def is_compact(self) -> bool:
+        return self._counter_mask < self._max_count
 
     
     def _add_counter(self, counter_idx: int):
+        check_writeable(self.counter_celled_bits)
+        if self.is_compact:
+            self._shift_counters(np.array([counter_idx]), 1)
+            return
         cell_idx = counter_idx // self._counter_in_cell
         start_bit_idx = (counter_idx % self._counter_in_cell) * self._counter_size
         logic_mask = self._counter_mask << start_bit_idx
@@ -36,9 +90,22 @@ class ConutersBloomFilter:
         if curent_counter_val != logic_mask:
             # Добавим в счетчик бит
             add_counter_val = curent_counter_val + (1 << start_bit_idx)
+            counter_val = int(curent_counter_val >> start_bit_idx)
+            self._counters_sum += 1
+            self._nonzero_count += counter_val == 0
+            self._saturated_count += counter_val + 1 == self._max_count
+            self._thres_count += counter_val + 1 == self.count_thres
 
         self.counter_celled_bits[cell_idx] = np.bitwise_or(self.counter_celled_bits[cell_idx] & ~logic_mask, add_counter_val)
 
+    def _track_counters(self, counter_vals: np.ndarray, new_vals: np.ndarray):
+        """ Обновляет сумму и кол-ва счётчиков, когда значения counter_vals заменяются на new_vals """
+        for vals, sign in ((new_vals, 1), (counter_vals, -1)):
+            self._counters_sum += sign * int(vals.sum())
+            self._nonzero_count += sign * int(np.count_nonzero(vals))
+            self._saturated_count += sign * int((vals == self._max_count).sum())
+            self._thres_count += sign * int((vals >= self.count_thres).sum())
+
     def _get_counter(self, counter_idx: int) -> int:
         cell_idx = counter_idx // self._counter_in_cell
         start_bit_idx = (counter_idx % self._counter_in_cell) * self._counter_size
@@ -46,11 +113,107 @@ class ConutersBloomFilter:
 
         tagret_bits = self.counter_celled_bits[cell_idx] & logic_mask
         tagret = tagret_bits >> start_bit_idx
+        if tagret == self._counter_mask and self.is_compact:
+            tagret += int(self._get_overflow(np.array([counter_idx]))[0])
         return tagret
 
+    def _get_overflow(self, counter_idxes: np.ndarray) -> np.ndarray:
+        if not len(self._overflow_idxes):
+            return np.zeros(counter_idxes.shape, dtype=np.int64)
+        table_idxes = np.searchsorted(self._overflow_idxes, counter_idxes)
+        table_idxes = np.minimum(table_idxes, len(self._overflow_idxes) - 1)
+        is_found = self._overflow_idxes[table_idxes] == counter_idxes
+        return np.where(is_found, self._overflow_counts[table_idxes], 0)
+
+    def _set_overflow(self, counter_idxes: np.ndarray, overflow_counts: np.ndarray):
+        """ Перезаписывает превышения попарно различных счётчиков, нулевые удаляются из таблицы """
+        is_other = ~np.isin(self._overflow_idxes, counter_idxes, assume_unique=True)
+        is_overflowed = overflow_counts > 0
+        all_idxes = np.concatenate([self._overflow_idxes[is_other], counter_idxes[is_overflowed]])
+        all_counts = np.concatenate([self._overflow_counts[is_other], overflow_counts[is_overflowed]])
+        order = np.argsort(all_idxes)
+        self._overflow_idxes, self._overflow_counts = all_idxes[order], all_counts[order]
+
+    def _counter_location(self, counter_idxes: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        cell_idxes = counter_idxes // self._counter_in_cell
+        start_bit_idxes = (counter_idxes % self._counter_in_cell) * self._counter_size
+        return cell_idxes, start_bit_idxes
+
+    def _get_counters(self, counter_idxes: np.ndarray) -> np.ndarray:
+        cell_idxes, start_bit_idxes = self._counter_location(counter_idxes)
+        counter_vals = (self.counter_celled_bits[cell_idxes] >> start_bit_idxes) & self._counter_mask
+        if self.is_compact and len(self._overflow_idxes):
+            # Превышение ищем только для счётчиков, упёршихся в свою ширину
+            is_full = counter_vals == self._counter_mask
+            counter_vals[is_full] += self._get_overflow(counter_idxes[is_full])
+        return counter_vals
+
+    def _shift_counters(self, counter_idxes: np.ndarray, sign: int):
+        # Проверка до изменения суммы и таблицы переполнений, чтобы ошибка не оставила их рассогласованными
+        check_writeable(self.counter_celled_bits)
+        # Одинаковые счётчики в батче схлопываются в один сдвиг на их кол-во
+        unique_idxes, repeats = np.unique(counter_idxes, return_counts=True)
+        cell_idxes, start_bit_idxes = self._counter_location(unique_idxes)
+        counter_vals = self._get_counters(unique_idxes)
+
+        if sign > 0:
+            # Насыщающее сложение - счётчик не переполняется
+            new_vals = np.minimum(counter_vals + repeats, self._max_count)
+        else:
+            # Насыщенный счётчик не уменьшаем: его истинное значение неизвестно
+            new_vals = np.where(
+                counter_vals == self._max_count,
+                counter_vals,
+                np.maximum(counter_vals - repeats, 0)
+            )
+        self._track_counters(counter_vals, new_vals)
+
+        if self.is_compact:
+            # В ячейке остаётся не больше _counter_mask, остальное - в таблице переполнений
+            is_overflowed = (new_vals >= self._counter_mask) | (counter_vals >= self._counter_mask)
+            self._set_overflow(unique_idxes[is_overflowed], new_vals[is_overflowed] - self._counter_mask)
+            new_vals = np.minimum(new_vals, self._counter_mask)
+            counter_vals = np.minimum(counter_vals, self._counter_mask)
+        deltas = new_vals - counter_vals
+
+        # Новое значение помещается в биты счётчика, поэтому переупаковка - это сложение сдвинутой разницы.
+        # Несколько счётчиков одной ячейки складываются корректно только через .at
+        ufunc_at(np.add, self.counter_celled_bits, cell_idxes, deltas << start_bit_idxes)
+
+    def _unpack_counters(self) -> np.ndarray:
+        """ Значения всех счётчиков ячеек (включая хвост последней ячейки) с учётом переполнений """
+        counter_vals = np.stack([
+            (self.counter_celled_bits >> (slot * self._counter_size)) & self._counter_mask
+            for slot in range(self._counter_in_cell)
+        ], axis=1).ravel()
+        counter_vals[self._overflow_idxes] += self._overflow_counts
+        return counter_vals
+
+    def _pack_counters(self, counter_vals: np.ndarray):
+        cell_vals = np.minimum(counter_vals, self._counter_mask).reshape(-1, self._counter_in_cell)
+        self.counter_celled_bits = np.zeros(len(cell_vals), dtype=np.int64)
+        for slot in range(self._counter_in_cell):
+            self.counter_celled_bits |= cell_vals[:, slot] << (slot * self._counter_size)
+        self._overflow_idxes = np.flatnonzero(counter_vals > self._counter_mask)
+        self._overflow_counts = counter_vals[self._overflow_idxes] - self._counter_mask
+
+    def _recount_counters(self):
+        self._counters_sum = self._nonzero_count = self._saturated_count = self._thres_count = 0
+        no_vals = np.zeros(0, dtype=np.int64)
+        if self.is_compact:
+            # Значения, упёршиеся в ширину ячейки, видны только вместе с таблицей переполнений
+            self._track_counters(no_vals, self._unpack_counters())
+            return
+        # Проходим по позициям счётчиков внутри ячейки, а не по каждому счётчику
+        for slot in range(self._counter_in_cell):
+            self._track_counters(no_vals, (self.counter_celled_bits >> (slot * self._counter_size)) & self._counter_mask)
+
     def hash(self, string: str) -> Generator:
-        for bf_seed in range(0, self.hash_num):
-            yield mmh3.hash(string, seed=bf_seed) % self.filter_size 
+        yield from key_positions(string, self.hash_num, self.filter_size, self.seed)
+
+    def hash_many(self, strings: Keys) -> np.ndarray:
+        # Позиции формы (кол-во ключей, hash_num)
+        return hashed_keys(strings, self.seed).positions(self.hash_num, self.filter_size)
 
     def put(self, string: str):
         string_hashes = self.hash(string)
@@ -64,6 +227,65 @@ class ConutersBloomFilter:
                 return False
         return True
 
+    def remove(self, string: str):
+        self.remove_many([string])
+
+    def put_many(self, strings: Keys):
+        string_hashes = self.hash_many(strings)
+        self._shift_counters(string_hashes.ravel(), 1)
+
+    def get_many(self, strings: Keys) -> np.ndarray:
+        return self.count_many(strings) >= self.count_thres
+
+    def count_many(self, strings: Keys) -> np.ndarray:
+        # Минимальный из hash_num счётчиков - оценка сверху кол-ва вставок ключа
+        string_hashes = self.hash_many(strings)
+        return self._get_counters(string_hashes).min(axis=1, initial=self._max_count)
+
+    def remove_many(self, strings: Keys):
+        string_hashes = self.hash_many(strings)
+        self._shift_counters(string_hashes.ravel(), -1)
+
     def size(self) -> int:
-        num_bits = sum(self._get_counter(idx) for idx in range(self.filter_size))
-        return num_bits/self.hash_num
\ No newline at end of file
+        return self._counters_sum/self.hash_num
+
+    def clear(self):
+        self.counter_celled_bits[:] = 0
+        self._overflow_idxes = np.zeros(0, dtype=np.int64)
+        self._overflow_counts = np.zeros(0, dtype=np.int64)
+        self._counters_sum = self._nonzero_count = self._saturated_count = self._thres_count = 0
+
+    def copy(self) -> 'ConutersBloomFilter':
+        return deepcopy(self)
+
+    def _check_compatible(self, other: 'ConutersBloomFilter'):
+        if not isinstance(other, ConutersBloomFilter):
+            raise TypeError(f'Cannot combine ConutersBloomFilter with {type(other).__name__}')
+        for attr in ('hash_num', 'filter_size', 'seed', '_counter_size', '_max_count'):
+            if getattr(self, attr) != getattr(other, attr):
+                raise ValueError(f'Incompatible filters: {attr} {getattr(self, attr)} != {getattr(other, attr)}')
+
+    def merge(self, other: 'ConutersBloomFilter') -> 'ConutersBloomFilter':
+        """ Объединение на месте: счётчики складываются с насыщением """
+        self._check_compatible(other)
+        if self.is_compact:
+            merged_vals = np.minimum(self._unpack_counters() + other._unpack_counters(), self._max_count)
+            self._pack_counters(merged_vals)
+            self._recount_counters()
+            return self
+        merged_cells = np.zeros_like(self.counter_celled_bits)
+        # Счётчики на одной позиции внутри ячейки складываются сразу для всех ячеек
+        for slot in range(self._counter_in_cell):
+            start_bit_idx = slot * self._counter_size
+            self_vals = (self.counter_celled_bits >> start_bit_idx) & self._counter_mask
+            other_vals = (other.counter_celled_bits >> start_bit_idx) & self._counter_mask
+            merged_cells |= np.minimum(self_vals + other_vals, self._counter_mask) << start_bit_idx
+        self.counter_celled_bits = merged_cells
+        self._recount_counters()
+        return self
+
+    def __or__(self, other: 'ConutersBloomFilter') -> 'ConutersBloomFilter':
+        return self.copy().merge(other)
+
+    def __ior__(self, other: 'ConutersBloomFilter') -> 'ConutersBloomFilter':
+        return self.merge(other)
\ No newline at end of file
@@ -0,0 +1,103 @@
+import os
+from itertools import chain, islice
+from typing import Generator, Iterable, Optional
+
+import numpy as np
+
+
+_NEWLINE = ord('\n')
+_COMMA = ord(',')
+_CARRIAGE_RETURN = ord('\r')
+
+
+def split_keys(data: bytes) -> list[bytes]:
+    """
+    Достаёт первую колонку из каждой строки блока, который состоит из целых строк
+
+    Концы строк и первые запятые ищутся векторизованно по всему блоку, без декодирования UTF-8:
+    mmh3 хеширует bytes так же, как соответствующую str
+    """
+    if not data:
+        return []
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    line_ends = np.flatnonzero(buffer == _NEWLINE)
+    if not len(line_ends) or line_ends[-1] != len(buffer) - 1:
+        # Последняя строка файла может быть без перевода строки
+        line_ends = np.append(line_ends, len(buffer))
+    line_starts = np.concatenate(([0], line_ends[:-1] + 1))
+
+    # Первая запятая не раньше начала строки; если она дальше конца строки - ключ занимает всю строку
+    commas = np.append(np.flatnonzero(buffer == _COMMA), len(buffer))
+    key_ends = np.minimum(commas[np.searchsorted(commas, line_starts)], line_ends)
+    # Как и rstrip() в read_csv_keys, отбросим \r у строк без запятой
+    has_cr = (key_ends == line_ends) & (key_ends > line_starts)
+    has_cr[has_cr] = buffer[key_ends[has_cr] - 1] == _CARRIAGE_RETURN
+    key_ends -= has_cr
+
+    return [data[start:end] for start, end in zip(line_starts.tolist(), key_ends.tolist())]
+
+
+def estimate_rows(csv_name: str, sample_size: int = 1 << 20) -> int:
+    """ Оценка кол-ва строк файла по средней длине строки в первых sample_size байтах """
+    file_size = os.path.getsize(csv_name)
+    with open(csv_name, 'rb') as f:
+        sample = f.read(sample_size)
+    if not sample:
+        return 0
+    lines_num = max(1, sample.count(b'\n'))
+    return int(np.ceil(file_size * lines_num / len(sample)))
+
+
+def read_key_batches(
+        csv_name: str,
+        start: int = 0,
+        end: Optional[int] = None,
+        chunk_size: int = 1 << 20,
+        ) -> Generator:
+    """
+    Читает первую колонку csv файла блоками по chunk_size байт и отдаёт ключи списками bytes
+
+    [start, end) - диапазон байт, границы которого совпадают с началами строк (см. parallel.split_file_ranges)
+    Каждый список можно сразу передать в put_many/get_many/add_many скетчей
+    """
+    with open(csv_name, 'rb') as f:
+        f.seek(start)
+        left_bytes = end - start if end is not None else None
+        tail = b''
+        while True:
+            read_size = chunk_size if left_bytes is None else min(chunk_size, left_bytes)
+            chunk = f.read(read_size) if read_size else b''
+            if left_bytes is not None:
+                left_bytes -= len(chunk)
+            if not chunk:
+                break
+
+            chunk = tail + chunk
+            # Неполная последняя строка блока переносится в следующий блок
+            last_newline = chunk.rfind(b'\n')
+            if last_newline == -1:
+                tail = chunk
+                continue
+            tail = chunk[last_newline + 1:]
+            yield split_keys(chunk[:last_newline + 1])
+
+        if tail:
+            yield split_keys(tail)
+
+
+def iter_key_batches(keys: Iterable, batch_size: int = 10**4) -> Generator:
+    """
+    Батчи ключей из потока батчей (как у read_key_batches) или из потока отдельных ключей
+
+    Поток батчей отдаётся как есть, поток ключей (str или bytes) режется на списки по batch_size
+    """
+    keys = iter(keys)
+    first = next(keys, None)
+    if first is None:
+        return
+    keys = chain([first], keys)
+    if not isinstance(first, (str, bytes)):
+        yield from keys
+        return
+    while keys_batch := list(islice(keys, batch_size)):
+        yield keys_batch
@@ -0,0 +1,204 @@
+import random
+from copy import deepcopy
+from typing import Union
+
+import numpy as np
+import mmh3
+
+from hashing import Keys, hashed_keys
+
+# Множитель Фибоначчи-хеширования: старшие биты произведения хорошо перемешаны
+_FP_MULTIPLIER = 0x9E3779B97F4A7C15
+_HASH_MASK = (1 << 64) - 1
+
+
+class CuckooFilter:
+    """
+    Cuckoo-фильтр (Fan et al.): отпечатки ключей в корзинах по bucket_size ячеек
+
+    Отпечаток ключа - fingerprint_bits старших битов h2 (0 означает пустую ячейку), основная корзина -
+    младшие биты h1, запасная - основная XOR хеш отпечатка, поэтому при вытеснении запасную корзину
+    можно найти по одному отпечатку. Если обе корзины заняты, случайный отпечаток вытесняется
+    в свою другую корзину - не больше max_kicks раз, после чего оставшийся отпечаток кладётся в stash.
+    Доля ложных срабатываний около 2 * bucket_size / 2**fingerprint_bits.
+    Отпечаток хранится в наименьшем беззнаковом типе, в который помещается: 8, 16 или 32 бита.
+    Повторная вставка ключа кладёт ещё один отпечаток, удаление убирает одну копию.
+    Копий в двух корзинах и stash не больше max_copies = 2 * bucket_size - дальше повторная вставка
+    пропускается, поэтому ключ, вставленный больше max_copies раз, исчезает уже после max_copies удалений.
+    Удалять можно только вставленные ключи - иначе может удалиться отпечаток другого ключа
+    """
+    def __init__(
+            self,
+            capacity: int,
+            fingerprint_bits: int = 16,
+            bucket_size: int = 4,
+            max_kicks: int = 500,
+            stash_size: int = 16,
+            seed: int = 0
+            ):
+        if not 1 <= fingerprint_bits <= 32:
+            raise ValueError(f'fingerprint_bits must be in [1, 32], got {fingerprint_bits}')
+        self.capacity = capacity
+        self.fingerprint_bits = fingerprint_bits
+        self.bucket_size = bucket_size
+        self.max_kicks = max_kicks
+        self.stash_size = stash_size
+        self.seed = seed
+        # Кол-во корзин - степень двойки, чтобы XOR не выводил запасную корзину за пределы таблицы.
+        # Заполнение выше ~95% делает вставки слишком долгими
+        self._bucket_bits = max(1, int(np.ceil(np.log2(capacity / (0.95 * bucket_size)))))
+        self.bucket_num = 1 << self._bucket_bits
+        fingerprint_dtype = np.uint8 if fingerprint_bits <= 8 else np.uint16 if fingerprint_bits <= 16 else np.uint32
+        self.buckets = np.zeros((self.bucket_num, bucket_size), dtype=fingerprint_dtype)
+        self.max_copies = 2 * bucket_size
+        # (меньшая из двух корзин, отпечаток) -> кол-во копий
+        self._stash: dict = {}
+        self._rng = random.Random(seed)
+        self.count = 0
+
+    def _key_location(self, h1: int, h2: int) -> tuple[int, int]:  # bucket, fingerprint
+        fingerprint = (h2 >> (64 - self.fingerprint_bits)) or 1
+        return h1 & (self.bucket_num - 1), fingerprint
+
+    def _alt_bucket(self, bucket: int, fingerprint: int) -> int:
+        return bucket ^ (((fingerprint * _FP_MULTIPLIER) & _HASH_MASK) >> (64 - self._bucket_bits))
+
+    def hash(self, string: Union[str, bytes]) -> tuple[int, int, int]:  # bucket, alt bucket, fingerprint
+        h1, h2 = mmh3.hash64(string, seed=self.seed, signed=False)
+        bucket, fingerprint = self._key_location(h1, h2)
+        return bucket, self._alt_bucket(bucket, fingerprint), fingerprint
+
+    def hash_many(self, strings: Keys) -> tuple[np.ndarray, np.ndarray, np.ndarray]:  # buckets, alt buckets, fingerprints
+        hashes = hashed_keys(strings, self.seed).hashes
+        fingerprints = hashes[:, 1] >> np.uint64(64 - self.fingerprint_bits)
+        fingerprints[fingerprints == 0] = 1
+        buckets = (hashes[:, 0] & np.uint64(self.bucket_num - 1)).astype(np.int64)
+        offsets = (fingerprints * np.uint64(_FP_MULTIPLIER)) >> np.uint64(64 - self._bucket_bits)
+        alt_buckets = buckets ^ offsets.astype(np.int64)
+        return buckets, alt_buckets, fingerprints.astype(self.buckets.dtype)
+
+    def _stash_key(self, bucket: int, fingerprint: int) -> tuple[int, int]:
+        return min(bucket, self._alt_bucket(bucket, fingerprint)), fingerprint
+
+    def _copies_num(self, buckets: np.ndarray, alt_buckets: np.ndarray, fingerprints: np.ndarray) -> np.ndarray:
+        """ Кол-во копий отпечатков в их корзинах и stash """
+        fingerprints = fingerprints[:, None]
+        copies_num = (self.buckets[buckets] == fingerprints).sum(axis=1)
+        # Если запасная корзина совпала с основной, её копии уже посчитаны
+        copies_num += np.where(alt_buckets != buckets, (self.buckets[alt_buckets] == fingerprints).sum(axis=1), 0)
+        if self._stash:
+            # Ключ stash - (меньшая корзина, отпечаток), упакованный в одно число для поиска по всем ключам сразу
+            stash_codes = np.array([(bucket << 32) | fingerprint for bucket, fingerprint in self._stash], dtype=np.int64)
+            stash_counts = np.array(list(self._stash.values()), dtype=np.int64)
+            order = np.argsort(stash_codes)
+            stash_codes, stash_counts = stash_codes[order], stash_counts[order]
+            codes = (np.minimum(buckets, alt_buckets) << 32) | fingerprints[:, 0].astype(np.int64)
+            stash_idxes = np.minimum(np.searchsorted(stash_codes, codes), len(stash_codes) - 1)
+            copies_num += np.where(stash_codes[stash_idxes] == codes, stash_counts[stash_idxes], 0)
+        return copies_num
+
+    def _kick_insert(self, bucket: int, alt_bucket: int, fingerprint: int):
+        """ Вставка с вытеснением, когда обе корзины ключа заполнены """
+        if sum(self._stash.values()) >= self.stash_size:
+            raise ValueError(f'Cuckoo filter is full: {self.count} fingerprints, stash_size={self.stash_size}')
+        bucket = self._rng.choice((bucket, alt_bucket))
+        for _ in range(self.max_kicks):
+            slot = self._rng.randrange(self.bucket_size)
+            fingerprint, self.buckets[bucket, slot] = int(self.buckets[bucket, slot]), fingerprint
+            bucket = self._alt_bucket(bucket, fingerprint)
+            free_slots = np.flatnonzero(self.buckets[bucket] == 0)
+            if len(free_slots):
+                self.buckets[bucket, free_slots[0]] = fingerprint
+                return
+        # Вытесненный отпечаток не нашёл места - он уже может принадлежать другому ключу
+        stash_key = self._stash_key(bucket, fingerprint)
+        self._stash[stash_key] = self._stash.get(stash_key, 0) + 1
+
+    def put(self, string: str):
+        self.put_many([string])
+
+    def get(self, string: Union[str, bytes]) -> bool:
+        bucket, alt_bucket, fingerprint = self.hash(string)
+        if fingerprint in self.buckets[bucket] or fingerprint in self.buckets[alt_bucket]:
+            return True
+        return bool(self._stash) and self._stash_key(bucket, fingerprint) in self._stash
+
+    def remove(self, string: str):
+        self.remove_many([string])
+
+    def put_many(self, strings: Keys):
+        buckets, alt_buckets, fingerprints = self.hash_many(strings)
+        pending = np.arange(len(fingerprints))
+        # Векторизованные раунды: ключ занимает свободную ячейку основной, иначе запасной корзины.
+        # За раунд в корзину попадает только первый претендент, остальные пробуют в следующем
+        while len(pending):
+            # Ключ, у которого уже max_copies копий, больше не вставляется
+            is_capped = self._copies_num(buckets[pending], alt_buckets[pending], fingerprints[pending]) >= self.max_copies
+            pending = pending[~is_capped]
+            has_free = (self.buckets[buckets[pending]] == 0).any(axis=1)
+            has_alt_free = (self.buckets[alt_buckets[pending]] == 0).any(axis=1)
+            is_placeable = has_free | has_alt_free
+            placeable = pending[is_placeable]
+            if not len(placeable):
+                break
+            target_buckets = np.where(has_free[is_placeable], buckets[placeable], alt_buckets[placeable])
+            target_buckets, first_idxes = np.unique(target_buckets, return_index=True)
+            claimed = placeable[first_idxes]
+            free_slots = (self.buckets[target_buckets] == 0).argmax(axis=1)
+            self.buckets[target_buckets, free_slots] = fingerprints[claimed]
+            self.count += len(claimed)
+            pending = np.setdiff1d(pending, claimed, assume_unique=True)
+
+        # Обе корзины оставшихся ключей заполнены - вставляем их по одному с вытеснением
+        for idx in pending.tolist():
+            if self._copies_num(buckets[idx:idx + 1], alt_buckets[idx:idx + 1], fingerprints[idx:idx + 1])[0] >= self.max_copies:
+                continue
+            self._kick_insert(int(buckets[idx]), int(alt_buckets[idx]), int(fingerprints[idx]))
+            self.count += 1
+
+    def get_many(self, strings: Keys) -> np.ndarray:
+        buckets, alt_buckets, fingerprints = self.hash_many(strings)
+        fingerprints = fingerprints[:, None]
+        result = (self.buckets[buckets] == fingerprints).any(axis=1) | (self.buckets[alt_buckets] == fingerprints).any(axis=1)
+        if self._stash:
+            for idx in np.flatnonzero(~result).tolist():
+                result[idx] = self._stash_key(int(buckets[idx]), int(fingerprints[idx, 0])) in self._stash
+        return result
+
+    def remove_many(self, strings: Keys):
+        buckets, alt_buckets, fingerprints = self.hash_many(strings)
+        pending = np.arange(len(fingerprints))
+        # Те же раунды, что и при вставке: из корзины за раунд удаляется одна копия
+        while len(pending):
+            pending_fingerprints = fingerprints[pending, None]
+            in_bucket = (self.buckets[buckets[pending]] == pending_fingerprints).any(axis=1)
+            in_alt_bucket = (self.buckets[alt_buckets[pending]] == pending_fingerprints).any(axis=1)
+            is_found = in_bucket | in_alt_bucket
+            found = pending[is_found]
+            if not len(found):
+                break
+            target_buckets = np.where(in_bucket[is_found], buckets[found], alt_buckets[found])
+            target_buckets, first_idxes = np.unique(target_buckets, return_index=True)
+            claimed = found[first_idxes]
+            slots = (self.buckets[target_buckets] == fingerprints[claimed, None]).argmax(axis=1)
+            self.buckets[target_buckets, slots] = 0
+            self.count -= len(claimed)
+            pending = np.setdiff1d(pending, claimed, assume_unique=True)
+
+        # Ключей, которых нет ни в корзинах, ни в stash, в фильтре нет - их удаление ничего не делает
+        for idx in pending.tolist():
+            stash_key = self._stash_key(int(buckets[idx]), int(fingerprints[idx]))
+            if stash_key in self._stash:
+                self._stash[stash_key] -= 1
+                if not self._stash[stash_key]:
+                    del self._stash[stash_key]
+                self.count -= 1
+
+    def size(self) -> int:
+        return self.count
+
+    def load_factor(self) -> float:
+        return self.count / self.buckets.size
+
+    def copy(self) -> 'CuckooFilter':
+        return deepcopy(self)
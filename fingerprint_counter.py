@@ -0,0 +1,147 @@
+from copy import deepcopy
+from typing import Optional
+
+import numpy as np
+
+from hashing import Keys, hashed_keys
+
+
+class FingerprintCounter:
+    """
+    Точный счётчик ключей на хеш-таблице с открытой адресацией по 64-битным отпечаткам ключей
+
+    Вместо строк хранится отпечаток (uint64) и кол-во (uint32) - 12 байт на ячейку таблицы.
+    Отпечатки разных ключей совпадают с вероятностью ~n**2 / 2**65, для 10**7 ключей это ~3e-6.
+    Ключи добавляются батчами: пробирование идёт векторизованно для всех ключей батча сразу
+    """
+    # Нулевой отпечаток означает пустую ячейку
+    _EMPTY = np.uint64(0)
+
+    # Во сколько раз таблица больше необходимого размера после расширения
+    _growth = 1.25
+
+    def __init__(self, capacity: int = 1 << 10, max_load: float = 0.7, seed: int = 0):
+        self.max_load = max_load
+        self.seed = seed
+        table_size = max(8, int(np.ceil(capacity / max_load)))
+        self.fingerprints = np.zeros(table_size, dtype=np.uint64)
+        self.counts = np.zeros(table_size, dtype=np.uint32)
+        self._keys_num = 0
+
+    def __len__(self) -> int:
+        return self._keys_num
+
+    def hash_many(self, strings: Keys) -> np.ndarray:
+        # Копия, чтобы не менять хеши, общие с другими скетчами
+        fingerprints = hashed_keys(strings, self.seed).hashes[:, 0].copy()
+        fingerprints[fingerprints == self._EMPTY] = 1
+        return fingerprints
+
+    def _start_slots(self, fingerprints: np.ndarray) -> np.ndarray:
+        # Размер таблицы не степень двойки, чтобы память росла плавно
+        return (fingerprints % np.uint64(len(self.fingerprints))).astype(np.int64)
+
+    def _find_slots(self, fingerprints: np.ndarray) -> np.ndarray:
+        """ Ячейки отпечатков или -1 для отсутствующих """
+        slots = self._start_slots(fingerprints)
+        result = np.full(len(fingerprints), -1, dtype=np.int64)
+        pending = np.arange(len(fingerprints))
+        table_size = len(self.fingerprints)
+        while len(pending):
+            slot_fingerprints = self.fingerprints[slots[pending]]
+            is_found = slot_fingerprints == fingerprints[pending]
+            result[pending[is_found]] = slots[pending[is_found]]
+            # Пустая ячейка обрывает цепочку пробирования - ключа нет
+            is_probing = ~is_found & (slot_fingerprints != self._EMPTY)
+            pending = pending[is_probing]
+            slots[pending] = (slots[pending] + 1) % table_size
+        return result
+
+    def _resize(self, table_size: int):
+        is_used = self.fingerprints != self._EMPTY
+        fingerprints, counts = self.fingerprints[is_used], self.counts[is_used]
+        self.fingerprints = np.zeros(table_size, dtype=np.uint64)
+        self.counts = np.zeros(table_size, dtype=np.uint32)
+        self._keys_num = 0
+        self._insert_unique(fingerprints, counts)
+
+    def _insert_unique(self, fingerprints: np.ndarray, counts: np.ndarray):
+        """ Вставка попарно различных отпечатков """
+        slots = self._start_slots(fingerprints)
+        pending = np.arange(len(fingerprints))
+        table_size = len(self.fingerprints)
+        while len(pending):
+            slot_fingerprints = self.fingerprints[slots[pending]]
+            is_found = slot_fingerprints == fingerprints[pending]
+            found = pending[is_found]
+            self.counts[slots[found]] += counts[found].astype(np.uint32)
+
+            # Одну пустую ячейку за шаг занимает только первый претендент, остальные проверят её снова
+            empty = pending[slot_fingerprints == self._EMPTY]
+            _, first_idxes = np.unique(slots[empty], return_index=True)
+            claimed = empty[first_idxes]
+            self.fingerprints[slots[claimed]] = fingerprints[claimed]
+            self.counts[slots[claimed]] = counts[claimed]
+            self._keys_num += len(claimed)
+
+            is_busy = ~is_found & (slot_fingerprints != self._EMPTY)
+            busy = pending[is_busy]
+            slots[busy] = (slots[busy] + 1) % table_size
+            pending = np.concatenate([busy, np.setdiff1d(empty, claimed, assume_unique=True)])
+
+    def add_fingerprints(self, fingerprints: np.ndarray, counts: Optional[np.ndarray] = None):
+        if counts is None:
+            fingerprints, counts = np.unique(fingerprints, return_counts=True)
+        new_keys_num = int((self._find_slots(fingerprints) < 0).sum())
+        required_size = (self._keys_num + new_keys_num) / self.max_load
+        if required_size > len(self.fingerprints):
+            self._resize(int(np.ceil(required_size * self._growth)))
+        self._insert_unique(fingerprints, counts)
+
+    def put(self, string: str):
+        self.put_many([string])
+
+    def put_many(self, strings: Keys):
+        self.add_fingerprints(self.hash_many(strings))
+
+    def count_many(self, strings: Keys) -> np.ndarray:
+        slots = self._find_slots(self.hash_many(strings))
+        return np.where(slots >= 0, self.counts[slots], 0).astype(np.uint32)
+
+    def items(self) -> tuple[np.ndarray, np.ndarray]:  # fingerprints, counts
+        """ Отпечатки по возрастанию и их кол-ва """
+        is_used = self.fingerprints != self._EMPTY
+        fingerprints, counts = self.fingerprints[is_used], self.counts[is_used]
+        order = np.argsort(fingerprints)
+        return fingerprints[order], counts[order]
+
+    def join_size(self, other: 'FingerprintCounter') -> int:
+        """ Сумма по общим ключам произведений их кол-в - слиянием отсортированных отпечатков """
+        if self.seed != other.seed:
+            raise ValueError(f'Incompatible counters: seed {self.seed} != {other.seed}')
+        self_fingerprints, self_counts = self.items()
+        other_fingerprints, other_counts = other.items()
+        _, self_idxes, other_idxes = np.intersect1d(
+            self_fingerprints, other_fingerprints, assume_unique=True, return_indices=True
+        )
+        products = self_counts[self_idxes].astype(np.uint64) * other_counts[other_idxes].astype(np.uint64)
+        return int(products.sum(dtype=np.uint64))
+
+    @property
+    def nbytes(self) -> int:
+        return self.fingerprints.nbytes + self.counts.nbytes
+
+    def copy(self) -> 'FingerprintCounter':
+        return deepcopy(self)
+
+    def merge(self, other: 'FingerprintCounter') -> 'FingerprintCounter':
+        if self.seed != other.seed:
+            raise ValueError(f'Incompatible counters: seed {self.seed} != {other.seed}')
+        self.add_fingerprints(*other.items())
+        return self
+
+    def __or__(self, other: 'FingerprintCounter') -> 'FingerprintCounter':
+        return self.copy().merge(other)
+
+    def __ior__(self, other: 'FingerprintCounter') -> 'FingerprintCounter':
+        return self.merge(other)
@@ -0,0 +1,45 @@
+import time
+from typing import Callable, Optional
+
+import numpy as np
+
+
+class GenerationRing:
+    """
+    Кольцо поколений скользящего окна времени для скетчей с ячейкой на поколение
+
+    Время делится на поколения длиной generation_span секунд, поколение занимает ячейку
+    generation % generations. Устаревшее поколение не удаляется отдельно, а обнуляется, когда его ячейку
+    занимает новое, поэтому окно - от (generations - 1) * generation_span до generations * generation_span секунд.
+    Время now по умолчанию - time.time(); поколения старше окна в кольцо не попадают
+    """
+    def __init__(self, generations: int, generation_span: float):
+        if generations < 1 or generation_span <= 0:
+            raise ValueError(f'Expected generations >= 1 and generation_span > 0, got {generations}, {generation_span}')
+        self.generations = generations
+        self.generation_span = generation_span
+        # Номер поколения (now // generation_span) в каждой ячейке кольца, -1 - ячейка пуста
+        self.generation_ids = np.full(generations, -1, dtype=np.int64)
+        self.latest_generation = -1
+
+    def generation(self, now: Optional[float] = None) -> int:
+        return int((time.time() if now is None else now) // self.generation_span)
+
+    def put_slot(self, now: Optional[float], clear_slot: Callable[[int], None]) -> Optional[int]:
+        """ Ячейка поколения now или None, если оно старше окна; при смене поколения ячейка обнуляется clear_slot """
+        generation = self.generation(now)
+        if generation <= self.latest_generation - self.generations:
+            return None
+        slot = generation % self.generations
+        if self.generation_ids[slot] != generation:
+            clear_slot(slot)
+            self.generation_ids[slot] = generation
+        self.latest_generation = max(self.latest_generation, generation)
+        return slot
+
+    def live_slots(self, now: Optional[float] = None, last_generations: Optional[int] = None) -> np.ndarray:
+        """ Ячейки последних last_generations поколений до now включительно (по умолчанию - всего окна) """
+        generation = self.generation(now)
+        last_generations = min(last_generations or self.generations, self.generations)
+        is_live = (self.generation_ids > generation - last_generations) & (self.generation_ids <= generation)
+        return np.flatnonzero(is_live)
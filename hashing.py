@@ -0,0 +1,134 @@
+from typing import Iterable, Union
+
+import numpy as np
+import mmh3
+
+
+Keys = Union[str, bytes, Iterable[Union[str, bytes]], 'HashedKeys']
+
+_HASH_MASK = (1 << 64) - 1
+
+
+def key_positions(key: Union[str, bytes], hash_num: int, size: int, seed: int = 0) -> list[int]:
+    """
+    Позиции ключа по схеме Kirsch–Mitzenmacher для одного ключа
+
+    Один 128-битный MurMurHash делится на две 64-битные половины h1 и h2,
+    i-я позиция считается как (h1 + i * h2) mod size.
+    Результат совпадает с `km_positions(hash_keys(key), ...)`, но без накладных расходов NumPy
+    """
+    h1, h2 = mmh3.hash64(key, seed=seed, signed=False)
+    return [((h1 + i * h2) & _HASH_MASK) % size for i in range(hash_num)]
+
+
+def hash_keys(keys: Keys, seed: int = 0) -> np.ndarray:
+    """
+    Считает по одному 128-битному MurMurHash на ключ
+
+    Возвращает массив формы (n, 2) из uint64 - две 64-битные половины хеша
+    """
+    if isinstance(keys, (str, bytes)):
+        keys = [keys]
+    hashes = [mmh3.hash64(key, seed=seed, signed=False) for key in keys]
+    return np.array(hashes, dtype=np.uint64).reshape(-1, 2)
+
+
+def km_positions(hashes: np.ndarray, hash_num: int, size: int) -> np.ndarray:
+    """
+    Векторизованная схема Kirsch–Mitzenmacher
+
+    По массиву хешей формы (n, 2) возвращает позиции формы (n, hash_num)
+    Умножение и сложение в uint64 переполняются так же, как `& _HASH_MASK` в `key_positions`
+    """
+    h1 = hashes[:, :1]
+    h2 = hashes[:, 1:]
+    steps = np.arange(hash_num, dtype=np.uint64)
+    positions = (h1 + steps * h2) % np.uint64(size)
+    return positions.astype(np.int64)
+
+
+def key_signs(key: Union[str, bytes], hash_num: int, seed: int = 0) -> list[int]:
+    """
+    Знаки ±1 ключа для hash_num строк count sketch
+
+    Берётся старший бит (h2 + i * h1) mod 2**64 - другой комбинации половин хеша, чем в `key_positions`,
+    чтобы знак не был связан с номером счётчика
+    """
+    h1, h2 = mmh3.hash64(key, seed=seed, signed=False)
+    return [1 - 2 * (((h2 + i * h1) & _HASH_MASK) >> 63) for i in range(hash_num)]
+
+
+def km_signs(hashes: np.ndarray, hash_num: int) -> np.ndarray:
+    """ Векторизованный `key_signs`: знаки формы (n, hash_num) """
+    h1 = hashes[:, :1]
+    h2 = hashes[:, 1:]
+    steps = np.arange(hash_num, dtype=np.uint64)
+    sign_bits = ((h2 + steps * h1) >> np.uint64(63)).astype(np.int64)
+    return 1 - 2 * sign_bits
+
+
+class HashedKeys:
+    """
+    Батч ключей, захешированный один раз: по одному 128-bit MurMurHash на ключ
+
+    Принимается в put_many/get_many/count_many/add_many всех скетчей вместо строк, поэтому ключ,
+    который кладётся в несколько скетчей, хешируется один раз. Позиции и знаки, посчитанные
+    из хешей, кэшируются по геометрии скетча: скетчи одинакового размера считают их тоже один раз
+    """
+    def __init__(self, keys: Keys, seed: int = 0):
+        if isinstance(keys, (str, bytes)):
+            keys = [keys]
+        self.keys = keys if isinstance(keys, list) else list(keys)
+        self.seed = seed
+        self.hashes = hash_keys(self.keys, seed)
+        self._positions: dict = {}
+        self._signs: dict = {}
+
+    @classmethod
+    def _from_hashes(cls, keys: list, hashes: np.ndarray, seed: int) -> 'HashedKeys':
+        hashed = cls.__new__(cls)
+        hashed.keys = keys
+        hashed.seed = seed
+        hashed.hashes = hashes
+        hashed._positions = {}
+        hashed._signs = {}
+        return hashed
+
+    def __len__(self) -> int:
+        return len(self.hashes)
+
+    def __iter__(self):
+        return iter(self.keys)
+
+    def __getitem__(self, idxes) -> 'HashedKeys':
+        """ Подмножество ключей по маске или индексам, без повторного хеширования """
+        idxes = np.arange(len(self))[idxes]
+        keys = [self.keys[idx] for idx in idxes.tolist()]
+        return self._from_hashes(keys, self.hashes[idxes], self.seed)
+
+    def positions(self, hash_num: int, size: int) -> np.ndarray:
+        """ `km_positions` формы (n, hash_num), посчитанные один раз на геометрию """
+        key = (hash_num, size)
+        if key not in self._positions:
+            self._positions[key] = km_positions(self.hashes, hash_num, size)
+        return self._positions[key]
+
+    def signs(self, hash_num: int) -> np.ndarray:
+        """ `km_signs` формы (n, hash_num), посчитанные один раз на кол-во строк """
+        if hash_num not in self._signs:
+            self._signs[hash_num] = km_signs(self.hashes, hash_num)
+        return self._signs[hash_num]
+
+    def unique(self) -> 'HashedKeys':
+        """ Ключи без повторов в порядке первого появления """
+        _, first_idxes = np.unique(self.hashes, axis=0, return_index=True)
+        return self[np.sort(first_idxes)]
+
+
+def hashed_keys(keys: Keys, seed: int = 0) -> HashedKeys:
+    """ Хеширует ключи или возвращает уже захешированные, если seed совпадает """
+    if isinstance(keys, HashedKeys):
+        if keys.seed != seed:
+            raise ValueError(f'Keys are hashed with seed {keys.seed}, sketch expects seed {seed}')
+        return keys
+    return HashedKeys(keys, seed)
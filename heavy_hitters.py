@@ -0,0 +1,117 @@
+from collections import Counter
+from copy import deepcopy
+from typing import Optional
+
+import numpy as np
+
+from count_min_sketch import CountMinSketch
+from hashing import HashedKeys, Keys, hashed_keys
+
+
+class MisraGries:
+    """
+    Сводка Misra–Gries для поиска частых ключей за один проход
+
+    Хранит не больше capacity ключей. Когда их становится больше, из всех счётчиков вычитается
+    (capacity + 1)-е по величине значение, а неположительные счётчики удаляются.
+    Истинное кол-во любого ключа лежит в [counters.get(key, 0), counters.get(key, 0) + error],
+    где error - сумма вычтенных значений и не превышает total / (capacity + 1).
+    Сводки складываются с теми же гарантиями, поэтому части файла можно считать отдельно
+    """
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.counters: dict = {}
+        self.total = 0
+        self.error = 0
+
+    def put(self, string: str):
+        self.put_many([string])
+
+    def put_many(self, strings: Keys):
+        if isinstance(strings, (str, bytes)):
+            strings = [strings]
+        elif isinstance(strings, HashedKeys):
+            strings = strings.keys
+        batch_counts = Counter(strings)
+        for key, count in batch_counts.items():
+            self.counters[key] = self.counters.get(key, 0) + count
+        self.total += sum(batch_counts.values())
+        if len(self.counters) > self.capacity:
+            self._prune()
+
+    def _prune(self):
+        counts = np.fromiter(self.counters.values(), dtype=np.int64, count=len(self.counters))
+        cut = int(np.partition(counts, -(self.capacity + 1))[-(self.capacity + 1)])
+        self.error += cut
+        self.counters = {key: count - cut for key, count in self.counters.items() if count > cut}
+
+    def bounds(self, string: str) -> tuple[int, int]:  # lower, upper
+        lower = self.counters.get(string, 0)
+        return lower, lower + self.error
+
+    def top(self, n: Optional[int] = None) -> list[tuple]:  # (key, lower, upper)
+        top_counts = sorted(self.counters.items(), key=lambda item: item[1], reverse=True)[:n]
+        return [(key, count, count + self.error) for key, count in top_counts]
+
+    def copy(self) -> 'MisraGries':
+        return deepcopy(self)
+
+    def merge(self, other: 'MisraGries') -> 'MisraGries':
+        if self.capacity != other.capacity:
+            raise ValueError(f'Incompatible summaries: capacity {self.capacity} != {other.capacity}')
+        for key, count in other.counters.items():
+            self.counters[key] = self.counters.get(key, 0) + count
+        self.total += other.total
+        self.error += other.error
+        if len(self.counters) > self.capacity:
+            self._prune()
+        return self
+
+    def __or__(self, other: 'MisraGries') -> 'MisraGries':
+        return self.copy().merge(other)
+
+    def __ior__(self, other: 'MisraGries') -> 'MisraGries':
+        return self.merge(other)
+
+
+class HeavyHitters:
+    """
+    Частые ключи с границами их кол-ва: Misra–Gries даёт кандидатов и нижнюю границу,
+    Count-Min Sketch с conservative update уточняет верхнюю
+    """
+    def __init__(self, capacity: int, cms_width: int = 1 << 16, cms_depth: int = 4, seed: int = 0):
+        self.summary = MisraGries(capacity)
+        self.count_min = CountMinSketch(width=cms_width, depth=cms_depth, conservative=True, seed=seed)
+
+    def put_many(self, strings: Keys):
+        # Хешируем ключи один раз для Count-Min Sketch, сводке нужны сами ключи
+        strings = hashed_keys(strings, self.count_min.seed)
+        self.summary.put_many(strings)
+        self.count_min.put_many(strings)
+
+    def put(self, string: str):
+        self.put_many([string])
+
+    @property
+    def untracked_upper(self) -> int:
+        """ Верхняя граница кол-ва любого ключа, которого нет среди кандидатов """
+        return self.summary.error
+
+    def candidates(self, count_thres: int) -> dict:
+        """ Ключи, которые могут встречаться не меньше count_thres раз -> (нижняя, верхняя) граница """
+        keys = list(self.summary.counters)
+        if not keys:
+            return {}
+        cms_counts = self.count_min.count_many(keys)
+        result = {}
+        for key, cms_count in zip(keys, cms_counts.tolist()):
+            lower, upper = self.summary.bounds(key)
+            upper = min(upper, cms_count)
+            if upper >= count_thres:
+                result[key] = (lower, upper)
+        return result
+
+    def merge(self, other: 'HeavyHitters') -> 'HeavyHitters':
+        self.summary.merge(other.summary)
+        self.count_min.merge(other.count_min)
+        return self
@@ -1,14 +1,22 @@
+from copy import deepcopy
+
 import numpy as np
 import mmh3
 
+from bit_array import bit_length, check_writeable, ufunc_at
+from hashing import Keys, hashed_keys
+
 
 class HyperLogLog:
-    def __init__(self, b: int):
+    def __init__(self, b: int, hash_size: int = 32):
+        if hash_size not in (32, 64):
+            raise ValueError(f'hash_size must be 32 or 64, got {hash_size}')
         self.b = b
         self.m = 1 << b # 2**b
-        self._hash_size = 32  # in bits
+        self._hash_size = hash_size  # in bits
         # Получим кол-во младших битов, выделенных под вычисление ранга
         self._rang_bits_size = self._hash_size - self.b
+        self._rang_mask = (1 << self._rang_bits_size) - 1
         self.registers = np.zeros(self.m, dtype=np.uint8)
 
     @staticmethod
@@ -22,29 +30,45 @@ class HyperLogLog:
         else:
             return (0.7213 / (1 + 1.079 / m))
 
-    @staticmethod
-    def hash(string: str):
-        return mmh3.hash(string, signed=False)
+    def hash(self, string: str) -> int:
+        # Младшая половина 128-битного хеша, как в HashedKeys: 32-битный хеш - её младшие биты
+        hash_value = mmh3.hash64(string, signed=False)[0]
+        return hash_value & ((1 << self._hash_size) - 1)
+
+    def hash_many(self, strings: Keys) -> np.ndarray:
+        hash_values = hashed_keys(strings).hashes[:, 0]
+        return hash_values & np.uint64((1 << self._hash_size) - 1)
 
     def hash_info(self, hash_value: int) -> tuple[int, int]:  # index, rang
         # Получим старшие биты индексы путём удаления младших битов ранга
-        index_bits: int = hash_value >> self._rang_bits_size
-        # Получим младшие биты ранга путём удаления старших битов индекса 
-        # (если кол-во биты хеша содержат старшие биты индексов, т.к. кол-вл битов числа динамическое с откидыванием старших бит 0)
-        rang_bits: int = hash_value << max(0, hash_value.bit_length() - self._rang_bits_size)
-        # Преврощаем биты в строку, переворачиваем её и откидываем служебные '0b', после чего ищем номер первого вхождения 1 в строку
-        rang = bin(rang_bits)[:1:-1].find('1') + 1
-        # Если '1' в строке не найдено (find вернул -1)
-        if rang == 0:
-            # Присвоим в качестве ранга максимально возможный ранг
-            rang = self._rang_bits_size
+        index_bits = hash_value >> self._rang_bits_size
+        # Получим младшие биты ранга путём удаления старших битов индекса
+        rang_bits = hash_value & self._rang_mask
+        # Ранг - позиция первой единицы слева среди битов ранга (для нулевых битов - максимальный ранг)
+        rang = self._rang_bits_size - rang_bits.bit_length() + 1
 
         return index_bits, rang
+
+    def hash_info_many(self, hash_values: np.ndarray) -> tuple[np.ndarray, np.ndarray]:  # indexes, rangs
+        index_bits = (hash_values >> np.uint64(self._rang_bits_size)).astype(np.int64)
+        rang_bits = hash_values & np.uint64(self._rang_mask)
+        rangs = self._rang_bits_size - bit_length(rang_bits) + 1
+
+        return index_bits, rangs.astype(np.uint8)
         
     def put(self, string: str):
+        # Регистр меняется не при каждом ключе - проверяем сразу, чтобы put на скетче только для чтения падал всегда
+        check_writeable(self.registers)
         hash_value = self.hash(string)
         index, rang = self.hash_info(hash_value)
-        self.registers[index] = rang
+        # Регистр хранит максимальный ранг среди попавших в него ключей
+        if rang > self.registers[index]:
+            self.registers[index] = rang
+
+    def add_many(self, strings: Keys):
+        hash_values = self.hash_many(strings)
+        indexes, rangs = self.hash_info_many(hash_values)
+        ufunc_at(np.maximum, self.registers, indexes, rangs)
 
     def est_size(self):
         # гармоническое среднее
@@ -57,9 +81,42 @@ class HyperLogLog:
             V = np.sum(self.registers == 0)
             #small range correction
             if V != 0:
-                E = self.m * np.log10(self.m / V)
-        elif E > (1 / 30) * (1 << 32):
-            # large range correction
-            E = -(1 << 32) * np.log10(1 - E / (1 << 32))
+                E = self.m * np.log(self.m / V)
+        elif self._hash_size == 32 and E > (1 / 30) * (1 << 32):
+            # large range correction (для 64-битного хеша коллизии не существенны)
+            E = -(1 << 32) * np.log(1 - E / (1 << 32))
+
+        return E
+
+    def copy(self) -> 'HyperLogLog':
+        return deepcopy(self)
+
+    def _check_compatible(self, other: 'HyperLogLog'):
+        # Точное совпадение типа: у HyperLogLogPlusPlus свой оценщик и разреженный режим без регистров
+        if type(other) is not type(self):
+            raise TypeError(f'Cannot combine {type(self).__name__} with {type(other).__name__}')
+        for attr in ('b', '_hash_size'):
+            if getattr(self, attr) != getattr(other, attr):
+                raise ValueError(f'Incompatible sketches: {attr} {getattr(self, attr)} != {getattr(other, attr)}')
+
+    def merge(self, other: 'HyperLogLog') -> 'HyperLogLog':
+        """ Объединение на месте: оценка даёт кол-во уникальных ключей обоих скетчей """
+        self._check_compatible(other)
+        np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+
+    def __or__(self, other: 'HyperLogLog') -> 'HyperLogLog':
+        return self.copy().merge(other)
+
+    def __ior__(self, other: 'HyperLogLog') -> 'HyperLogLog':
+        return self.merge(other)
+
+    def est_intersection_size(self, other: 'HyperLogLog'):
+        """
+        Оценка кол-ва общих уникальных ключей по формуле включений-исключений |A| + |B| - |A ∪ B|
 
-        return E
\ No newline at end of file
+        Погрешность определяется погрешностью оценок размеров множеств, а не пересечения,
+        поэтому для малых пересечений относительная ошибка велика
+        """
+        union_size = (self | other).est_size()
+        return max(0, self.est_size() + other.est_size() - union_size)
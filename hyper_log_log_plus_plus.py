@@ -0,0 +1,162 @@
+import numpy as np
+
+from bit_array import bit_length, ufunc_at, varint_decode, varint_encode
+from hashing import Keys
+from hyper_log_log import HyperLogLog
+
+
+class HyperLogLogPlusPlus(HyperLogLog):
+    """
+    HyperLogLog++ на 64-битном хеше
+
+    Пока ключей мало, вместо 2**b регистров хранится разреженное представление:
+    отсортированные пары (индекс, ранг) с точностью sparse_b, закодированные как
+    varint-разности соседних значений. Как только разреженное представление
+    становится больше плотного, оно переводится в обычные регистры.
+    Оценка в плотном режиме - улучшенный оценщик Ertl, не требующий таблиц поправок смещения
+    """
+    # Под ранг в закодированной паре отводится 6 младших бит
+    _rang_code_bits = 6
+
+    def __init__(self, b: int, sparse_b: int = 25, sparse: bool = True):
+        super().__init__(b, hash_size=64)
+        # Индекс точности sparse_b вместе с рангом должен помещаться в 64 бита
+        if not b <= sparse_b <= self._hash_size - self._rang_code_bits:
+            raise ValueError(f'sparse_b must be in [{b}, {self._hash_size - self._rang_code_bits}], got {sparse_b}')
+        self.sparse_b = sparse_b
+        self._sparse_rang_bits_size = self._hash_size - sparse_b
+        self._sparse_rang_mask = (1 << self._sparse_rang_bits_size) - 1
+        # Закодированные varint-разности отсортированных пар (индекс, ранг)
+        self._sparse_list = b''
+        # Ещё не слитые с _sparse_list пары
+        self._sparse_buffer = []
+        self._sparse_buffer_size = 0
+        self._sparse_buffer_thres = max(64, self.m // 16)
+        # Разреженное представление не должно занимать больше плотного (байт на регистр)
+        self._sparse_thres = self.m
+        if sparse:
+            self.registers = None
+
+    @property
+    def is_sparse(self) -> bool:
+        return self.registers is None
+
+    def _sparse_codes(self, hash_values: np.ndarray) -> np.ndarray:
+        sparse_idxes = hash_values >> np.uint64(self._sparse_rang_bits_size)
+        rang_bits = hash_values & np.uint64(self._sparse_rang_mask)
+        rangs = (self._sparse_rang_bits_size - bit_length(rang_bits) + 1).astype(np.uint64)
+        return (sparse_idxes << np.uint64(self._rang_code_bits)) | rangs
+
+    def _merge_sparse(self) -> np.ndarray:
+        codes = np.cumsum(varint_decode(self._sparse_list), dtype=np.uint64)
+        if self._sparse_buffer:
+            codes = np.sort(np.concatenate([codes, *self._sparse_buffer]))
+            # После сортировки максимальный ранг индекса стоит последним - оставим только его
+            sparse_idxes = codes >> np.uint64(self._rang_code_bits)
+            is_last = np.append(sparse_idxes[1:] != sparse_idxes[:-1], True)
+            codes = codes[is_last]
+            self._sparse_list = varint_encode(np.diff(codes, prepend=np.uint64(0)))
+            self._sparse_buffer = []
+            self._sparse_buffer_size = 0
+        return codes
+
+    def _add_sparse(self, codes: np.ndarray):
+        self._sparse_buffer.append(codes)
+        self._sparse_buffer_size += len(codes)
+        if self._sparse_buffer_size < self._sparse_buffer_thres:
+            return
+        self._merge_sparse()
+        if len(self._sparse_list) > self._sparse_thres:
+            self.to_dense()
+
+    def to_dense(self):
+        if not self.is_sparse:
+            return
+        codes = self._merge_sparse()
+        sparse_idxes = codes >> np.uint64(self._rang_code_bits)
+        sparse_rangs = (codes & np.uint64((1 << self._rang_code_bits) - 1)).astype(np.int64)
+
+        # Биты индекса точности sparse_b, не вошедшие в индекс точности b, - начало битов ранга
+        extra_bits_size = self.sparse_b - self.b
+        indexes = (sparse_idxes >> np.uint64(extra_bits_size)).astype(np.int64)
+        extra_bits = sparse_idxes & np.uint64((1 << extra_bits_size) - 1)
+        rangs = np.where(
+            extra_bits > 0,
+            extra_bits_size - bit_length(extra_bits) + 1,
+            extra_bits_size + sparse_rangs,
+        )
+
+        self.registers = np.zeros(self.m, dtype=np.uint8)
+        ufunc_at(np.maximum, self.registers, indexes, rangs.astype(np.uint8))
+        self._sparse_list = b''
+
+    def put(self, string: str):
+        if not self.is_sparse:
+            return super().put(string)
+        hash_values = np.array([self.hash(string)], dtype=np.uint64)
+        self._add_sparse(self._sparse_codes(hash_values))
+
+    def add_many(self, strings: Keys):
+        if not self.is_sparse:
+            return super().add_many(strings)
+        self._add_sparse(self._sparse_codes(self.hash_many(strings)))
+
+    @staticmethod
+    def _sigma(x: float) -> float:
+        if x == 1:
+            return np.inf
+        y = 1
+        z = x
+        while True:
+            x *= x
+            z_old = z
+            z += x * y
+            y += y
+            if z == z_old:
+                return z
+
+    @staticmethod
+    def _tau(x: float) -> float:
+        if x == 0 or x == 1:
+            return 0
+        y = 1
+        z = 1 - x
+        while True:
+            x = np.sqrt(x)
+            z_old = z
+            y *= 0.5
+            z -= (1 - x) ** 2 * y
+            if z == z_old:
+                return z / 3
+
+    def est_size(self):
+        if self.is_sparse:
+            # Линейный подсчёт по 2**sparse_b виртуальным регистрам
+            sparse_m = 1 << self.sparse_b
+            V = sparse_m - len(self._merge_sparse())
+            return sparse_m * np.log(sparse_m / V)
+
+        q = self._rang_bits_size
+        C = np.bincount(self.registers, minlength=q + 2)
+        z = self.m * self._tau(1 - C[q + 1] / self.m)
+        for k in range(q, 0, -1):
+            z = (z + C[k]) * 0.5
+        z += self.m * self._sigma(C[0] / self.m)
+        alpha_inf = 0.5 / np.log(2)
+        return alpha_inf * self.m**2 / z
+
+    def _check_compatible(self, other: 'HyperLogLogPlusPlus'):
+        super()._check_compatible(other)
+        if self.sparse_b != other.sparse_b:
+            raise ValueError(f'Incompatible sketches: sparse_b {self.sparse_b} != {other.sparse_b}')
+
+    def merge(self, other: 'HyperLogLogPlusPlus') -> 'HyperLogLogPlusPlus':
+        self._check_compatible(other)
+        if self.is_sparse and other.is_sparse:
+            self._add_sparse(other._merge_sparse())
+            return self
+        if other.is_sparse:
+            other = other.copy()
+            other.to_dense()
+        self.to_dense()
+        return super().merge(other)
@@ -0,0 +1,115 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Callable, Generator, Optional
+
+
+def split_file_ranges(file_name: str, shards_num: int) -> list[tuple[int, int]]:
+    """
+    Делит файл на shards_num диапазонов байт [start, end), границы которых выровнены по концам строк
+
+    Каждая строка файла попадает ровно в один диапазон. Диапазоны могут оказаться пустыми,
+    если строк меньше, чем частей - такие диапазоны отбрасываются
+    """
+    file_size = os.path.getsize(file_name)
+    bounds = [0]
+    with open(file_name, 'rb') as f:
+        for shard_idx in range(1, shards_num):
+            pos = file_size * shard_idx // shards_num
+            if pos <= bounds[-1]:
+                continue
+            # Граница сдвигается на начало следующей строки
+            f.seek(pos - 1)
+            f.readline()
+            bounds.append(min(f.tell(), file_size))
+    bounds.append(file_size)
+    return [(start, end) for start, end in zip(bounds[:-1], bounds[1:]) if start < end]
+
+
+def default_shards_num(workers: Optional[int] = None) -> int:
+    # Частей больше, чем процессов, чтобы неравномерные по длине строки не оставляли процессы без работы
+    return (workers or os.cpu_count()) * 4
+
+
+def map_file_shards(
+        csv_name: str,
+        shard_func: Callable,
+        shards_num: int,
+        workers: Optional[int] = None,
+        initializer: Optional[Callable] = None,
+        initargs: tuple = (),
+        ) -> Generator:
+    """
+    Применяет shard_func(csv_name, start, end) к диапазонам файла в пуле процессов
+
+    Большие объекты, общие для всех частей (например, фильтр-шаблон), передаются через
+    initializer - так они сериализуются один раз на процесс, а не на каждую часть.
+    Результаты отдаются по мере готовности, чтобы их можно было сразу слить и освободить память
+    """
+    ranges = split_file_ranges(csv_name, shards_num)
+    with ProcessPoolExecutor(max_workers=workers, initializer=initializer, initargs=initargs) as executor:
+        futures = {executor.submit(shard_func, csv_name, start, end) for start, end in ranges}
+        while futures:
+            future = next(as_completed(futures))
+            futures.remove(future)
+            yield future.result()
+
+
+def default_workers_num(shards_num: int, workers: Optional[int] = None) -> int:
+    return min(workers or os.cpu_count(), shards_num)
+
+
+_worker_shards = {}
+
+
+def _init_worker_shards(ranges, next_range_idx, initializer, initargs):
+    _worker_shards.update(ranges=ranges, next_range_idx=next_range_idx)
+    if initializer is not None:
+        initializer(*initargs)
+
+
+def _run_worker_shards(csv_name, shard_func, result_func):
+    ranges = _worker_shards['ranges']
+    next_range_idx = _worker_shards['next_range_idx']
+    while True:
+        with next_range_idx.get_lock():
+            range_idx = next_range_idx.value
+            next_range_idx.value += 1
+        if range_idx >= len(ranges):
+            break
+        shard_func(csv_name, *ranges[range_idx])
+    return result_func()
+
+
+def map_worker_shards(
+        csv_name: str,
+        shard_func: Callable,
+        result_func: Callable,
+        shards_num: int,
+        workers: Optional[int] = None,
+        initializer: Optional[Callable] = None,
+        initargs: tuple = (),
+        ) -> Generator:
+    """
+    Применяет shard_func(csv_name, start, end) к диапазонам файла в пуле процессов и отдаёт по одному
+    результату result_func() на процесс
+
+    В отличие от map_file_shards, shard_func ничего не возвращает, а копит результат в состоянии процесса
+    (например, в одном фильтре на процесс) - так родитель получает и сливает не shards_num больших
+    объектов, а default_workers_num(shards_num, workers). Процессы берут следующий диапазон
+    из общего счётчика, поэтому неравномерные части всё так же распределяются между ними динамически
+    """
+    ranges = split_file_ranges(csv_name, shards_num)
+    workers = default_workers_num(len(ranges), workers) if ranges else 0
+    next_range_idx = multiprocessing.Value('q', 0)
+    with ProcessPoolExecutor(
+            max_workers=max(1, workers),
+            initializer=_init_worker_shards,
+            initargs=(ranges, next_range_idx, initializer, initargs),
+            ) as executor:
+        # Если процесс успеет выполнить две задачи, вторая не найдёт диапазонов и вернёт пустой результат
+        futures = {executor.submit(_run_worker_shards, csv_name, shard_func, result_func) for _ in range(workers)}
+        while futures:
+            future = next(as_completed(futures))
+            futures.remove(future)
+            yield future.result()
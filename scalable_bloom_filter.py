@@ -0,0 +1,97 @@
+import numpy as np
+
+from bloom_filter_n_hash import BloomFilterNHash
+from hashing import Keys, hashed_keys
+
+
+class ScalableBloomFilter:
+    """
+    Масштабируемый Bloom-фильтр (Almeida et al.) на цепочке BloomFilterNHash
+
+    Когда в текущий фильтр вставлено столько ключей, на сколько он рассчитан, добавляется следующий:
+    в growth раз больше по ёмкости и с долей ложных срабатываний в tightening раз меньше.
+    Доли ложных срабатываний фильтров образуют геометрическую прогрессию с первым членом
+    target_fp * (1 - tightening), поэтому общая доля не превышает target_fp при любом кол-ве ключей
+    """
+    def __init__(
+            self,
+            initial_capacity: int,
+            target_fp: float,
+            growth: int = 2,
+            tightening: float = 0.85,
+            seed: int = 0
+            ):
+        if growth < 1 or not 0 < tightening < 1:
+            raise ValueError(f'Expected growth >= 1 and tightening in (0, 1), got {growth}, {tightening}')
+        self.initial_capacity = initial_capacity
+        self.target_fp = target_fp
+        self.growth = growth
+        self.tightening = tightening
+        self.seed = seed
+        self.filters: list[BloomFilterNHash] = []
+        self._capacities: list[int] = []
+        # Кол-во ключей, вставленных в последний фильтр
+        self._last_count = 0
+        self.count = 0
+        self._add_filter()
+
+    def _add_filter(self):
+        filter_idx = len(self.filters)
+        capacity = self.initial_capacity * self.growth ** filter_idx
+        filter_fp = self.target_fp * (1 - self.tightening) * self.tightening ** filter_idx
+        self.filters.append(BloomFilterNHash.from_capacity(capacity, filter_fp, seed=self.seed))
+        self._capacities.append(capacity)
+        self._last_count = 0
+
+    def put(self, string: str):
+        # Уже присутствующий ключ не тратит ёмкость
+        if self.get(string):
+            return
+        if self._last_count >= self._capacities[-1]:
+            self._add_filter()
+        self.filters[-1].put(string)
+        self._last_count += 1
+        self.count += 1
+
+    def get(self, string: str) -> bool:
+        # Новые фильтры самые большие и содержат больше ключей - проверяем их первыми
+        return any(bloom_filter.get(string) for bloom_filter in reversed(self.filters))
+
+    def put_many(self, strings: Keys):
+        # Все фильтры цепочки с одним seed - ключи хешируются один раз для всех
+        # Повторы внутри батча и уже присутствующие ключи не тратят ёмкость
+        strings = hashed_keys(strings, self.seed).unique()
+        if not len(strings):
+            return
+        new_strings = strings[~self.get_many(strings)]
+
+        while len(new_strings):
+            if self._last_count >= self._capacities[-1]:
+                self._add_filter()
+            free_capacity = self._capacities[-1] - self._last_count
+            self.filters[-1].put_many(new_strings[:free_capacity])
+            inserted = min(free_capacity, len(new_strings))
+            self._last_count += inserted
+            self.count += inserted
+            new_strings = new_strings[free_capacity:]
+
+    def get_many(self, strings: Keys) -> np.ndarray:
+        strings = hashed_keys(strings, self.seed)
+        result = self.filters[-1].get_many(strings)
+        for bloom_filter in self.filters[:-1]:
+            not_found = ~result
+            if not not_found.any():
+                break
+            result[not_found] = bloom_filter.get_many(strings[not_found])
+        return result
+
+    def size(self) -> int:
+        return sum(bloom_filter.size() for bloom_filter in self.filters)
+
+    def est_fp_rate(self) -> float:
+        """ Ожидаемая доля ложных срабатываний по текущему заполнению фильтров """
+        miss_prob = 1.0
+        for bloom_filter in self.filters:
+            fill_ratio = bloom_filter._ones_count / bloom_filter.filter_size
+            miss_prob *= 1 - fill_ratio ** bloom_filter.hash_num
+        return 1 - miss_prob
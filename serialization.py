@@ -0,0 +1,230 @@
+"""
+Формат файла скетча:
+
+    MAGIC (8 байт) | длина заголовка (uint64 little-endian) | JSON заголовок | выравнивание до 64 байт | данные
+
+Заголовок содержит версию формата, тип скетча и его описание: скалярные параметры (размеры, сиды, счётчики),
+номера массивов данных и описания вложенных скетчей (фильтры цепочки, поколения окна, части составного скетча).
+Для каждого массива в заголовке лежат dtype, форма, смещение в данных и CRC32. Данные - это сырые NumPy массивы
+скетча, каждый выровнен по 64 байтам, поэтому при загрузке их можно отобразить в память через np.memmap без копирования
+"""
+import json
+import random
+import zlib
+from typing import Optional
+
+import numpy as np
+
+from blocked_bloom_filter import BlockedBloomFilter
+from bloom_filter import BloomFilter
+from bloom_filter_n_hash import BloomFilterNHash
+from count_min_sketch import CountMinSketch
+from count_sketch import CountSketch
+from counter_bloom_filter import ConutersBloomFilter
+from cuckoo_filter import CuckooFilter
+from fingerprint_counter import FingerprintCounter
+from generation_ring import GenerationRing
+from heavy_hitters import HeavyHitters, MisraGries
+from hyper_log_log import HyperLogLog
+from hyper_log_log_plus_plus import HyperLogLogPlusPlus
+from scalable_bloom_filter import ScalableBloomFilter
+from sliding_hyper_log_log import SlidingHyperLogLog
+from windowed_bloom_filter import WindowedBloomFilter
+
+
+MAGIC = b'SKETCH\x00\x00'
+FORMAT_VERSION = 2
+_PAYLOAD_ALIGN = 64
+_CRC_CHUNK_SIZE = 1 << 24
+_SCALAR_TYPES = (bool, int, float, str, type(None))
+
+# Типы, которые можно сохранить - скетчи и части составных скетчей
+SKETCH_TYPES = {
+    sketch_cls.__name__: sketch_cls
+    for sketch_cls in (
+        BloomFilter, BloomFilterNHash, BlockedBloomFilter, ConutersBloomFilter, CuckooFilter, ScalableBloomFilter,
+        WindowedBloomFilter, HyperLogLog, HyperLogLogPlusPlus, SlidingHyperLogLog, CountMinSketch, CountSketch,
+        FingerprintCounter, MisraGries, HeavyHitters, GenerationRing,
+    )
+}
+
+
+def _payload_crc32(payload: np.ndarray) -> int:
+    data = memoryview(np.ascontiguousarray(payload)).cast('B')
+    crc = 0
+    for start in range(0, len(data), _CRC_CHUNK_SIZE):
+        crc = zlib.crc32(data[start:start + _CRC_CHUNK_SIZE], crc)
+    return crc
+
+
+def _is_sketch(value) -> bool:
+    return SKETCH_TYPES.get(type(value).__name__) is type(value)
+
+
+def _sketch_state(sketch) -> dict:
+    """ Атрибуты скетча, которые сохраняются; то, что не лежит в скаляре или массиве, переводится в них """
+    state = dict(vars(sketch))
+    if isinstance(sketch, HyperLogLogPlusPlus):
+        if sketch.is_sparse:
+            # Разреженное представление сохраняется уже слитым, без буфера
+            sketch._merge_sparse()
+        state['_sparse_list'] = np.frombuffer(sketch._sparse_list, dtype=np.uint8)
+        del state['_sparse_buffer']
+    elif isinstance(sketch, CuckooFilter):
+        # Stash мал, он хранится в заголовке тройками (корзина, отпечаток, кол-во копий)
+        state['_stash'] = [[*stash_key, count] for stash_key, count in sketch._stash.items()]
+        del state['_rng']
+    elif isinstance(sketch, MisraGries):
+        # Ключи сводки - одним массивом байт с концами ключей
+        keys = list(sketch.counters)
+        keys_are_str = all(isinstance(key, str) for key in keys)
+        if not keys_are_str and not all(isinstance(key, bytes) for key in keys):
+            raise TypeError('MisraGries keys must be all str or all bytes to be saved')
+        key_bytes = [key.encode() for key in keys] if keys_are_str else keys
+        del state['counters']
+        state['_keys_are_str'] = keys_are_str
+        state['_key_bytes'] = np.frombuffer(b''.join(key_bytes), dtype=np.uint8)
+        state['_key_ends'] = np.cumsum([len(key) for key in key_bytes], dtype=np.int64)
+        state['_key_counts'] = np.fromiter(sketch.counters.values(), dtype=np.int64, count=len(keys))
+    return state
+
+
+def _restore_state(sketch):
+    """ Обратное к _sketch_state преобразование атрибутов загруженного скетча """
+    if isinstance(sketch, HyperLogLogPlusPlus):
+        sketch._sparse_list = sketch._sparse_list.tobytes()
+        sketch._sparse_buffer = []
+    elif isinstance(sketch, CuckooFilter):
+        sketch._stash = {(bucket, fingerprint): count for bucket, fingerprint, count in sketch._stash}
+        sketch._rng = random.Random(sketch.seed)
+    elif isinstance(sketch, MisraGries):
+        key_bytes = sketch._key_bytes.tobytes()
+        key_ends = sketch._key_ends.tolist()
+        keys = [key_bytes[start:end] for start, end in zip([0, *key_ends[:-1]], key_ends)]
+        if sketch._keys_are_str:
+            keys = [key.decode() for key in keys]
+        sketch.counters = dict(zip(keys, sketch._key_counts.tolist()))
+        for attr in ('_keys_are_str', '_key_bytes', '_key_ends', '_key_counts'):
+            delattr(sketch, attr)
+
+
+def _describe(sketch, arrays: list) -> dict:
+    """ Описание скетча для заголовка; его массивы добавляются в arrays, в описании - их номера """
+    type_name = type(sketch).__name__
+    if not _is_sketch(sketch):
+        raise TypeError(f'Unsupported sketch type: {type_name}')
+
+    description = {'type': type_name, 'params': {}, 'arrays': {}, 'sketches': {}}
+    for attr, value in _sketch_state(sketch).items():
+        if isinstance(value, _SCALAR_TYPES):
+            description['params'][attr] = value
+        elif isinstance(value, np.ndarray):
+            description['arrays'][attr] = len(arrays)
+            arrays.append(value)
+        elif _is_sketch(value):
+            description['sketches'][attr] = _describe(value, arrays)
+        elif isinstance(value, list) and all(isinstance(item, (*_SCALAR_TYPES, list)) for item in value):
+            description['params'][attr] = value
+        elif isinstance(value, list) and all(_is_sketch(item) for item in value):
+            description['sketches'][attr] = [_describe(item, arrays) for item in value]
+        else:
+            raise TypeError(f'Cannot save {type_name}.{attr} of type {type(value).__name__}')
+    return description
+
+
+def _build(description: dict, arrays: list):
+    if description['type'] not in SKETCH_TYPES:
+        raise ValueError(f'Unknown sketch type: {description["type"]}')
+    sketch_cls = SKETCH_TYPES[description['type']]
+    # Конструктор не вызывается, чтобы не выделять память под массивы, которые всё равно заменятся данными файла
+    sketch = sketch_cls.__new__(sketch_cls)
+    vars(sketch).update(description['params'])
+    for attr, array_idx in description['arrays'].items():
+        setattr(sketch, attr, arrays[array_idx])
+    for attr, nested in description['sketches'].items():
+        if isinstance(nested, list):
+            setattr(sketch, attr, [_build(item, arrays) for item in nested])
+        else:
+            setattr(sketch, attr, _build(nested, arrays))
+    _restore_state(sketch)
+    return sketch
+
+
+def save(sketch, file_name: str):
+    arrays = []
+    description = _describe(sketch, arrays)
+    array_headers = []
+    payload_size = 0
+    for array in arrays:
+        payload_size += -payload_size % _PAYLOAD_ALIGN
+        array_headers.append({
+            'dtype': array.dtype.str,
+            'shape': list(array.shape),
+            'offset': payload_size,
+            'crc32': _payload_crc32(array),
+        })
+        payload_size += array.nbytes
+    header = {
+        'version': FORMAT_VERSION,
+        'type': description['type'],
+        'sketch': description,
+        'arrays': array_headers,
+        'payload_size': payload_size,
+    }
+    header_bytes = json.dumps(header).encode()
+    header_end = len(MAGIC) + 8 + len(header_bytes)
+
+    with open(file_name, 'wb') as f:
+        f.write(MAGIC)
+        f.write(len(header_bytes).to_bytes(8, 'little'))
+        f.write(header_bytes)
+        f.write(b'\x00' * (-header_end % _PAYLOAD_ALIGN))
+        written = 0
+        for array, array_header in zip(arrays, array_headers):
+            f.write(b'\x00' * (array_header['offset'] - written))
+            f.write(memoryview(np.ascontiguousarray(array)).cast('B'))
+            written = array_header['offset'] + array.nbytes
+
+
+def read_header(file_name: str) -> tuple[dict, int]:
+    """ Возвращает заголовок файла скетча и смещение данных """
+    with open(file_name, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f'{file_name} is not a sketch file')
+        header_len = int.from_bytes(f.read(8), 'little')
+        header = json.loads(f.read(header_len))
+    if header['version'] != FORMAT_VERSION:
+        raise ValueError(f'Unsupported sketch format version: {header["version"]}')
+    header_end = len(MAGIC) + 8 + header_len
+    return header, header_end + (-header_end % _PAYLOAD_ALIGN)
+
+
+def load(file_name: str, mmap_mode: Optional[str] = 'c', verify: bool = False):
+    """
+    Загружает скетч из файла
+
+    mmap_mode передаётся в np.memmap: 'c' - копирование при записи (страницы файла разделяются между процессами
+    через page cache, пока в них не пишут), 'r+' - изменения пишутся в файл, None - данные читаются в память целиком.
+    'r' - только для запросов: изменение такого скетча бросает ValueError.
+    verify=True сверяет CRC32 массивов с заголовком - это требует прочитать файл целиком
+    """
+    header, payload_offset = read_header(file_name)
+    payload_size = header['payload_size']
+    if mmap_mode is None or not payload_size:
+        # np.memmap не умеет отображать пустые массивы
+        payload = np.fromfile(file_name, dtype=np.uint8, count=payload_size, offset=payload_offset)
+    else:
+        # Одно отображение на весь файл, массивы скетча - срезы в нём
+        payload = np.memmap(file_name, dtype=np.uint8, mode=mmap_mode, offset=payload_offset, shape=payload_size)
+
+    arrays = []
+    for array_header in header['arrays']:
+        dtype = np.dtype(array_header['dtype'])
+        shape = tuple(array_header['shape'])
+        start = array_header['offset']
+        array = payload[start:start + dtype.itemsize * int(np.prod(shape))].view(dtype).reshape(shape)
+        if verify and _payload_crc32(array) != array_header['crc32']:
+            raise ValueError(f'Checksum mismatch in {file_name}')
+        arrays.append(array)
+
+    return _build(header['sketch'], arrays)
@@ -0,0 +1,18 @@
+import numpy as np
+
+
+def sketch_nbytes(sketch) -> int:
+    """ Память данных скетча: массивы, разреженные представления в bytes и вложенные скетчи """
+    nbytes = 0
+    for value in vars(sketch).values():
+        if isinstance(value, np.ndarray):
+            nbytes += value.nbytes
+        elif isinstance(value, bytes):
+            nbytes += len(value)
+        elif isinstance(value, list):
+            # Цепочки и кольца скетчей (ScalableBloomFilter, WindowedBloomFilter)
+            nbytes += sum(sketch_nbytes(item) for item in value if hasattr(item, '__dict__'))
+        elif hasattr(value, '__dict__'):
+            # Части составных скетчей (HeavyHitters, SlidingHyperLogLog)
+            nbytes += sketch_nbytes(value)
+    return nbytes
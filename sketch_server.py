@@ -0,0 +1,369 @@
+"""
+Сервис приёма ключей в скетчи: asyncio-сервер по TCP или Unix-сокету и клиент к нему
+
+    python sketch_server.py --port 8765
+    python sketch_server.py --unix /tmp/sketches.sock
+
+Сообщение в обе стороны - кадр: длина JSON заголовка и длина тела (два uint32 big-endian),
+затем заголовок и тело. Батч ключей в теле: кол-во ключей n, n длин ключей (uint32 big-endian) и сами ключи подряд,
+поэтому ключ может содержать любые байты, в том числе быть пустым.
+Запрос - заголовок {"op": ..., "sketch": имя, ...}, ответ - {"ok": true, ...} или {"ok": false, "error": ...}.
+Операции:
+    create      - создать скетч: {"type": имя класса, "params": аргументы конструктора}
+    put         - добавить батч ключей (put_many или add_many скетча)
+    remove      - удалить батч ключей (remove_many)
+    get         - принадлежность батча ключей: тело ответа - по байту 0/1 на ключ
+    count       - оценки кол-в батча ключей: тело ответа - uint64 на ключ
+    estimate    - оценка размера: est_size() или size()
+    join_size   - размер JOIN скетчей "sketch" и "other" (CountSketch, FingerprintCounter)
+    metrics     - метрики одного скетча или всех, если "sketch" не задан
+    list        - имена и типы скетчей
+Батч применяется целиком между итерациями цикла событий, поэтому запросы других соединений
+отвечают между батчами, не дожидаясь конца приёма
+"""
+import argparse
+import asyncio
+import json
+import struct
+import time
+from typing import Optional
+
+import numpy as np
+
+from blocked_bloom_filter import BlockedBloomFilter
+from bloom_filter import BloomFilter
+from bloom_filter_n_hash import BloomFilterNHash
+from count_min_sketch import CountMinSketch
+from count_sketch import CountSketch
+from counter_bloom_filter import ConutersBloomFilter
+from cuckoo_filter import CuckooFilter
+from fingerprint_counter import FingerprintCounter
+from hyper_log_log import HyperLogLog
+from hyper_log_log_plus_plus import HyperLogLogPlusPlus
+from scalable_bloom_filter import ScalableBloomFilter
+from sketch_memory import sketch_nbytes
+
+
+# Скетчи, которые можно создать через create
+SKETCH_CLASSES = {
+    sketch_cls.__name__: sketch_cls
+    for sketch_cls in (
+        BloomFilter, BloomFilterNHash, BlockedBloomFilter, ConutersBloomFilter, CuckooFilter, ScalableBloomFilter,
+        HyperLogLog, HyperLogLogPlusPlus, CountMinSketch, CountSketch, FingerprintCounter,
+    )
+}
+
+_FRAME_HEADER = struct.Struct('>II')
+# Верхние границы корзин гистограммы задержки батча, мс; последняя корзина - всё, что дольше
+LATENCY_BOUNDS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 1000)
+
+
+async def read_frame(reader: asyncio.StreamReader) -> tuple[dict, bytes]:
+    header_size, body_size = _FRAME_HEADER.unpack(await reader.readexactly(_FRAME_HEADER.size))
+    header = json.loads(await reader.readexactly(header_size))
+    body = await reader.readexactly(body_size) if body_size else b''
+    return header, body
+
+
+def write_frame(writer: asyncio.StreamWriter, header: dict, body: bytes = b''):
+    header_bytes = json.dumps(header).encode()
+    writer.write(_FRAME_HEADER.pack(len(header_bytes), len(body)) + header_bytes + body)
+
+
+_KEYS_NUM = struct.Struct('>I')
+_KEY_LENGTH_DTYPE = np.dtype('>u4')
+
+
+def encode_keys(keys) -> bytes:
+    keys = [key.encode() if isinstance(key, str) else key for key in keys]
+    key_lengths = np.fromiter((len(key) for key in keys), dtype=_KEY_LENGTH_DTYPE, count=len(keys))
+    return _KEYS_NUM.pack(len(keys)) + key_lengths.tobytes() + b''.join(keys)
+
+
+def decode_keys(body: bytes) -> list[bytes]:
+    if len(body) < _KEYS_NUM.size:
+        raise ValueError('Keys batch is too short')
+    keys_num, = _KEYS_NUM.unpack_from(body)
+    keys_start = _KEYS_NUM.size + keys_num * _KEY_LENGTH_DTYPE.itemsize
+    if len(body) < keys_start:
+        raise ValueError(f'Keys batch is too short for {keys_num} key lengths')
+    key_ends = keys_start + np.cumsum(
+        np.frombuffer(body, dtype=_KEY_LENGTH_DTYPE, count=keys_num, offset=_KEYS_NUM.size), dtype=np.int64
+    )
+    if (key_ends[-1] if keys_num else keys_start) != len(body):
+        raise ValueError('Keys batch length does not match the key lengths')
+    key_starts = np.concatenate(([keys_start], key_ends[:-1]))
+    return [body[start:end] for start, end in zip(key_starts.tolist(), key_ends.tolist())]
+
+
+def sketch_stats(sketch) -> dict:
+    """
+    Заполнение, насыщенные счётчики и ожидаемая доля ложных срабатываний по текущему состоянию скетча
+
+    Для Bloom-фильтров доля ложных срабатываний - fill_ratio ** hash_num,
+    для фильтра со счётчиками - доля счётчиков не меньше порога в степени hash_num
+    """
+    stats = {}
+    if isinstance(sketch, ConutersBloomFilter):
+        # Кол-ва счётчиков фильтр поддерживает сам - без распаковки всех счётчиков в цикле событий
+        stats['fill_ratio'] = sketch._nonzero_count / sketch.filter_size
+        stats['saturated_counters'] = sketch._saturated_count
+        stats['est_fp_rate'] = (sketch._thres_count / sketch.filter_size) ** sketch.hash_num
+    elif isinstance(sketch, (BloomFilter, BloomFilterNHash)):
+        stats['fill_ratio'] = sketch._ones_count / sketch.filter_size
+        stats['est_fp_rate'] = stats['fill_ratio'] ** getattr(sketch, 'hash_num', 1)
+    elif isinstance(sketch, CuckooFilter):
+        stats['fill_ratio'] = sketch.load_factor()
+        # Ключ сравнивается в среднем с 2 * bucket_size * load_factor отпечатками
+        compared_num = 2 * sketch.bucket_size * stats['fill_ratio']
+        stats['est_fp_rate'] = 1 - (1 - 2.0 ** -sketch.fingerprint_bits) ** compared_num
+        stats['stash_size'] = sum(sketch._stash.values())
+    elif isinstance(sketch, ScalableBloomFilter):
+        last_filter = sketch.filters[-1]
+        stats['fill_ratio'] = last_filter._ones_count / last_filter.filter_size
+        stats['est_fp_rate'] = sketch.est_fp_rate()
+        stats['filters_num'] = len(sketch.filters)
+    elif isinstance(sketch, HyperLogLog):
+        if sketch.registers is not None:
+            stats['fill_ratio'] = np.count_nonzero(sketch.registers) / sketch.m
+    elif isinstance(sketch, (CountMinSketch, CountSketch)):
+        stats['fill_ratio'] = np.count_nonzero(sketch.counters) / sketch.counters.size
+        if isinstance(sketch, CountMinSketch):
+            stats['saturated_counters'] = int((sketch.counters == np.iinfo(np.uint64).max).sum())
+            stats['error_bound'] = sketch.error_bound()
+    elif isinstance(sketch, FingerprintCounter):
+        stats['fill_ratio'] = len(sketch) / len(sketch.fingerprints)
+        stats['saturated_counters'] = int((sketch.counts == np.iinfo(np.uint32).max).sum())
+    stats['memory_bytes'] = sketch_nbytes(sketch)
+    return stats
+
+
+class SketchMetrics:
+    """ Счётчики приёма одного скетча: кол-во ключей и батчей, скорость и гистограмма задержки батча """
+    def __init__(self):
+        self.created_at = time.monotonic()
+        self.keys_total = 0
+        self.batches_total = 0
+        self.queries_total = 0
+        self.busy_seconds = 0.0
+        self.latency_counts = np.zeros(len(LATENCY_BOUNDS_MS) + 1, dtype=np.int64)
+
+    def observe_batch(self, keys_num: int, seconds: float):
+        self.keys_total += keys_num
+        self.batches_total += 1
+        self.busy_seconds += seconds
+        self.latency_counts[np.searchsorted(LATENCY_BOUNDS_MS, seconds * 1000)] += 1
+
+    def as_dict(self) -> dict:
+        uptime = time.monotonic() - self.created_at
+        return {
+            'keys_total': self.keys_total,
+            'batches_total': self.batches_total,
+            'queries_total': self.queries_total,
+            # Средняя скорость с момента создания и скорость самого применения батчей
+            'keys_per_sec': self.keys_total / uptime if uptime else 0.0,
+            'busy_keys_per_sec': self.keys_total / self.busy_seconds if self.busy_seconds else 0.0,
+            'batch_latency_ms': {
+                'bounds': [*LATENCY_BOUNDS_MS, 'inf'],
+                'counts': self.latency_counts.tolist(),
+            },
+        }
+
+
+class SketchServer:
+    def __init__(self):
+        self.sketches: dict = {}
+        self.metrics: dict[str, SketchMetrics] = {}
+
+    def add_sketch(self, name: str, sketch):
+        if name in self.sketches:
+            raise ValueError(f'Sketch {name!r} already exists')
+        self.sketches[name] = sketch
+        self.metrics[name] = SketchMetrics()
+
+    def _sketch(self, name: str):
+        if name not in self.sketches:
+            raise KeyError(f'Unknown sketch {name!r}')
+        return self.sketches[name]
+
+    def sketch_metrics(self, name: str) -> dict:
+        sketch = self._sketch(name)
+        return {'type': type(sketch).__name__, **self.metrics[name].as_dict(), **sketch_stats(sketch)}
+
+    def handle(self, header: dict, body: bytes) -> tuple[dict, bytes]:
+        """ Выполняет один запрос, возвращает заголовок и тело ответа """
+        op = header.get('op')
+        name = header.get('sketch')
+
+        if op == 'create':
+            sketch_type = header['type']
+            if sketch_type not in SKETCH_CLASSES:
+                raise TypeError(f'Unsupported sketch type: {sketch_type}')
+            self.add_sketch(name, SKETCH_CLASSES[sketch_type](**header.get('params', {})))
+            return {'ok': True}, b''
+        if op == 'list':
+            return {'ok': True, 'sketches': {name: type(sketch).__name__ for name, sketch in self.sketches.items()}}, b''
+        if op == 'metrics':
+            names = [name] if name is not None else list(self.sketches)
+            return {'ok': True, 'metrics': {name: self.sketch_metrics(name) for name in names}}, b''
+
+        sketch = self._sketch(name)
+        if op in ('put', 'remove'):
+            keys = decode_keys(body)
+            start = time.perf_counter()
+            if op == 'remove':
+                sketch.remove_many(keys)
+            elif hasattr(sketch, 'put_many'):
+                sketch.put_many(keys)
+            else:
+                sketch.add_many(keys)
+            self.metrics[name].observe_batch(len(keys), time.perf_counter() - start)
+            return {'ok': True, 'keys': len(keys)}, b''
+
+        self.metrics[name].queries_total += 1
+        if op == 'get':
+            return {'ok': True}, np.asarray(sketch.get_many(decode_keys(body)), dtype=np.uint8).tobytes()
+        if op == 'count':
+            return {'ok': True}, np.asarray(sketch.count_many(decode_keys(body)), dtype=np.uint64).tobytes()
+        if op == 'estimate':
+            estimate = sketch.est_size() if hasattr(sketch, 'est_size') else sketch.size()
+            return {'ok': True, 'estimate': float(estimate)}, b''
+        if op == 'join_size':
+            other = self._sketch(header['other'])
+            if isinstance(sketch, CountSketch):
+                return {'ok': True, 'estimate': sketch.est_join_size(other), 'std': sketch.join_std(other)}, b''
+            if isinstance(sketch, FingerprintCounter):
+                return {'ok': True, 'estimate': sketch.join_size(other), 'std': 0.0}, b''
+            raise TypeError(f'join_size is not supported for {type(sketch).__name__}')
+        raise ValueError(f'Unknown op: {op!r}')
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                try:
+                    header, body = await read_frame(reader)
+                except (asyncio.IncompleteReadError, ConnectionResetError):
+                    break
+                try:
+                    response_header, response_body = self.handle(header, body)
+                except Exception as error:
+                    # Ошибка запроса не закрывает соединение
+                    response_header, response_body = {'ok': False, 'error': f'{type(error).__name__}: {error}'}, b''
+                write_frame(writer, response_header, response_body)
+                await writer.drain()
+        finally:
+            writer.close()
+
+    async def start(self, host: str = '127.0.0.1', port: int = 8765, unix_path: Optional[str] = None) -> asyncio.AbstractServer:
+        if unix_path is not None:
+            return await asyncio.start_unix_server(self.handle_connection, path=unix_path)
+        return await asyncio.start_server(self.handle_connection, host=host, port=port)
+
+
+class SketchClient:
+    """ Клиент с пулом из pool_size соединений: запросы разных задач идут по свободным соединениям параллельно """
+    def __init__(self, host: str = '127.0.0.1', port: int = 8765, unix_path: Optional[str] = None, pool_size: int = 4):
+        self.host = host
+        self.port = port
+        self.unix_path = unix_path
+        self.pool_size = pool_size
+        self._pool: Optional[asyncio.Queue] = None
+
+    async def _open_connection(self) -> tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        if self.unix_path is not None:
+            return await asyncio.open_unix_connection(self.unix_path)
+        return await asyncio.open_connection(self.host, self.port)
+
+    async def connect(self) -> 'SketchClient':
+        self._pool = asyncio.Queue()
+        for _ in range(self.pool_size):
+            self._pool.put_nowait(await self._open_connection())
+        return self
+
+    async def close(self):
+        while not self._pool.empty():
+            connection = self._pool.get_nowait()
+            if connection is not None:
+                _, writer = connection
+                writer.close()
+                await writer.wait_closed()
+
+    async def __aenter__(self) -> 'SketchClient':
+        return await self.connect()
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def request(self, header: dict, body: bytes = b'') -> tuple[dict, bytes]:
+        # None в пуле - место закрытого соединения, вместо него открывается новое
+        connection = await self._pool.get()
+        try:
+            if connection is None:
+                connection = await self._open_connection()
+            reader, writer = connection
+            write_frame(writer, header, body)
+            await writer.drain()
+            response_header, response_body = await read_frame(reader)
+        except BaseException:
+            # После ошибки или отмены в сокете может остаться непрочитанный ответ - такое соединение
+            # нельзя отдавать следующему запросу, оно закрывается
+            if connection is not None:
+                connection[1].close()
+            self._pool.put_nowait(None)
+            raise
+        self._pool.put_nowait(connection)
+        if not response_header['ok']:
+            raise RuntimeError(response_header['error'])
+        return response_header, response_body
+
+    async def create(self, name: str, sketch_type: str, **params):
+        await self.request({'op': 'create', 'sketch': name, 'type': sketch_type, 'params': params})
+
+    async def put_many(self, name: str, keys):
+        await self.request({'op': 'put', 'sketch': name}, encode_keys(keys))
+
+    async def remove_many(self, name: str, keys):
+        await self.request({'op': 'remove', 'sketch': name}, encode_keys(keys))
+
+    async def get_many(self, name: str, keys) -> np.ndarray:
+        _, body = await self.request({'op': 'get', 'sketch': name}, encode_keys(keys))
+        return np.frombuffer(body, dtype=np.uint8).astype(bool)
+
+    async def count_many(self, name: str, keys) -> np.ndarray:
+        _, body = await self.request({'op': 'count', 'sketch': name}, encode_keys(keys))
+        return np.frombuffer(body, dtype=np.uint64)
+
+    async def estimate(self, name: str) -> float:
+        header, _ = await self.request({'op': 'estimate', 'sketch': name})
+        return header['estimate']
+
+    async def join_size(self, name: str, other: str) -> tuple[float, float]:  # estimate, std
+        header, _ = await self.request({'op': 'join_size', 'sketch': name, 'other': other})
+        return header['estimate'], header['std']
+
+    async def metrics(self, name: Optional[str] = None) -> dict:
+        header, _ = await self.request({'op': 'metrics', 'sketch': name})
+        return header['metrics']
+
+    async def list(self) -> dict:
+        header, _ = await self.request({'op': 'list'})
+        return header['sketches']
+
+
+async def serve(host: str, port: int, unix_path: Optional[str] = None):
+    server = await SketchServer().start(host, port, unix_path)
+    async with server:
+        await server.serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--unix', help='Unix socket path instead of TCP')
+    args = parser.parse_args(argv)
+    asyncio.run(serve(args.host, args.port, args.unix))
+
+
+if __name__ == '__main__':
+    main()
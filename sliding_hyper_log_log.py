@@ -0,0 +1,44 @@
+from typing import Optional
+
+import numpy as np
+
+from bit_array import ufunc_at
+from generation_ring import GenerationRing
+from hashing import Keys
+from hyper_log_log import HyperLogLog
+
+
+class SlidingHyperLogLog:
+    """
+    HyperLogLog по скользящему окну времени: кольцо поколений (GenerationRing) из регистров под-скетчей
+
+    Оценка по окну - est_size HyperLogLog от поэлементного максимума регистров живых поколений,
+    как при слиянии скетчей. Через last_generations можно спросить и про окно короче:
+    например, при generation_span=300 и generations=12 - про последние 5, 10, ..., 60 минут
+    """
+    def __init__(self, b: int, generations: int, generation_span: float, hash_size: int = 64):
+        self.ring = GenerationRing(generations, generation_span)
+        # Скетч для хеширования и оценки, его регистры подменяются объединением живых поколений
+        self._sketch = HyperLogLog(b, hash_size)
+        self.registers = np.zeros((generations, self._sketch.m), dtype=np.uint8)
+
+    def _clear_registers(self, slot: int):
+        self.registers[slot] = 0
+
+    def put(self, string: str, now: Optional[float] = None):
+        self.add_many([string], now)
+
+    def add_many(self, strings: Keys, now: Optional[float] = None):
+        slot = self.ring.put_slot(now, self._clear_registers)
+        if slot is None:
+            return
+        indexes, rangs = self._sketch.hash_info_many(self._sketch.hash_many(strings))
+        ufunc_at(np.maximum, self.registers[slot], indexes, rangs)
+
+    def window_registers(self, now: Optional[float] = None, last_generations: Optional[int] = None) -> np.ndarray:
+        """ Регистры объединения последних last_generations поколений (по умолчанию - всего окна) """
+        return self.registers[self.ring.live_slots(now, last_generations)].max(axis=0, initial=0)
+
+    def est_size(self, now: Optional[float] = None, last_generations: Optional[int] = None) -> float:
+        self._sketch.registers = self.window_registers(now, last_generations)
+        return self._sketch.est_size()
@@ -1,9 +1,15 @@
 import random
 import uuid
+from collections import Counter
+from typing import Optional
 
 from tqdm import tqdm
 
 from counter_bloom_filter import ConutersBloomFilter
+from heavy_hitters import HeavyHitters
+from csv_keys import estimate_rows, iter_key_batches, read_key_batches
+from hashing import HashedKeys
+from parallel import default_shards_num, default_workers_num, map_worker_shards
 
 
 def gen_grouped_seq(name, pattern, *, n_extra_cols=0, to_shuffle=False):
@@ -65,26 +71,211 @@ def read_csv_keys(csv_name):
 
 def count_keys(keys_iter, counter_bf: ConutersBloomFilter,
                sup_counter_bf: ConutersBloomFilter = None,
-                return_keys: bool = False) -> set:
+                return_keys: bool = False,
+                batch_size: int = 10**4) -> set:
+    """ keys_iter - ключи или их батчи, например из read_key_batches; ключи-bytes возвращаются строками """
     thres_keys = set()
 
-    # Пройдёмся по всем ключам
-    for key in keys_iter:
-        # Если вспомогательный фильтр не определен 
-        # или ключ встречается достаточное кол-во раз во вспомогательном фильтре
-        if sup_counter_bf is None or sup_counter_bf.get(key):
-            # Добавим ключ в основной фильтр
-            counter_bf.put(key)
-            # Если в основном фильтре их набралось пороговое кол-во - запомним
-            if return_keys and counter_bf.get(key):
-                old_len = len(thres_keys)
-                thres_keys.add(key)
-                if len(thres_keys) - old_len:
+    # Пройдёмся по всем ключам батчами, чтобы фильтры работали через векторизованные put_many/get_many
+    for keys_batch in iter_key_batches(keys_iter, batch_size):
+        # Хешируем батч один раз: позиции общие для всех фильтров с тем же seed и размером
+        keys_batch = HashedKeys(keys_batch, counter_bf.seed)
+        # Если вспомогательный фильтр определен - оставим только ключи,
+        # которые встречаются достаточное кол-во раз во вспомогательном фильтре
+        if sup_counter_bf is not None:
+            sup_keys = keys_batch if sup_counter_bf.seed == counter_bf.seed else keys_batch.keys
+            keys_batch = keys_batch[sup_counter_bf.get_many(sup_keys)]
+        if not len(keys_batch):
+            continue
+        # Добавим ключи в основной фильтр
+        counter_bf.put_many(keys_batch)
+        # Если в основном фильтре их набралось пороговое кол-во - запомним
+        if return_keys:
+            for key, is_thres in zip(keys_batch.keys, counter_bf.get_many(keys_batch)):
+                if isinstance(key, bytes):
+                    key = key.decode()
+                if is_thres and key not in thres_keys:
+                    thres_keys.add(key)
                     print('Add new key:', key)
     
     return thres_keys
 
 
+def count_keys_single_pass(csv_names, count_thres: int, capacity: Optional[int] = None,
+                           chunk_size: int = 1 << 20, fallback_fp: float = 0.01) -> set:
+    """
+    Ключи, которые встречаются не меньше count_thres раз в каждом из файлов
+
+    По каждому файлу за один проход строится HeavyHitters (Misra–Gries + Count-Min Sketch).
+    Ключ, у которого нижняя граница кол-ва во всех файлах не меньше порога, - точно частый,
+    ключ, у которого верхняя граница хотя бы в одном файле меньше порога, - точно нет.
+    Повторный проход нужен только по файлам, где границы оставшихся ключей неоднозначны,
+    и в нём точно считаются только эти ключи.
+
+    Ошибка сводки не больше кол-ва строк файла / (capacity + 1), поэтому по умолчанию capacity -
+    удвоенное оценённое кол-во строк файла, делённое на count_thres: тогда ключ вне сводки встречается
+    меньше count_thres / 2 раз. Если ошибка всё же дошла до порога, частый ключ мог не попасть в сводку -
+    тогда ключи ищутся двумя проходами count_keys по цепочке ConutersBloomFilter с долей ошибок fallback_fp
+    """
+    file_hitters = []
+    for csv_name in csv_names:
+        file_capacity = capacity or max(1, 2 * estimate_rows(csv_name) // count_thres)
+        hitters = HeavyHitters(file_capacity)
+        for keys_batch in read_key_batches(csv_name, chunk_size=chunk_size):
+            hitters.put_many(keys_batch)
+        if hitters.untracked_upper >= count_thres:
+            print(
+                f'capacity={file_capacity} is too small for {csv_name}: untracked keys may occur up to '
+                f'{hitters.untracked_upper} >= {count_thres} times, fall back to count_keys'
+            )
+            return _count_keys_two_pass(csv_names, count_thres, chunk_size, fallback_fp)
+        file_hitters.append(hitters)
+
+    file_candidates = [hitters.candidates(count_thres) for hitters in file_hitters]
+    candidate_keys = set.intersection(*(set(candidates) for candidates in file_candidates))
+
+    thres_keys = set()
+    # Файл -> ключи, границы которых в этом файле неоднозначны
+    ambiguous_keys = {}
+    for key in candidate_keys:
+        ambiguous_files = [
+            file_idx for file_idx, candidates in enumerate(file_candidates)
+            if candidates[key][0] < count_thres
+        ]
+        if ambiguous_files:
+            for file_idx in ambiguous_files:
+                ambiguous_keys.setdefault(file_idx, set()).add(key)
+        else:
+            thres_keys.add(key)
+
+    # Проверочный проход с точным подсчётом только неоднозначных ключей
+    rejected_keys = set()
+    for file_idx, keys in ambiguous_keys.items():
+        exact_counts = Counter()
+        for keys_batch in read_key_batches(csv_names[file_idx], chunk_size=chunk_size):
+            exact_counts.update(key for key in keys_batch if key in keys)
+        rejected_keys |= {key for key in keys if exact_counts[key] < count_thres}
+    thres_keys |= set().union(*ambiguous_keys.values()) - rejected_keys
+
+    thres_keys = {key.decode() for key in thres_keys}
+    for key in thres_keys:
+        print('Add new key:', key)
+    return thres_keys
+
+
+def _count_keys_two_pass(csv_names, count_thres: int, chunk_size: int, target_fp: float) -> set:
+    """ count_keys по всем файлам: фильтр каждого файла считает только ключи, частые в предыдущем """
+    sup_counter_bf = None
+    for file_idx, csv_name in enumerate(csv_names):
+        counter_bf = ConutersBloomFilter.from_capacity(
+            max(1, estimate_rows(csv_name)), target_fp, counter_num=count_thres, count_thres=count_thres
+        )
+        thres_keys = count_keys(
+            read_key_batches(csv_name, chunk_size=chunk_size),
+            counter_bf=counter_bf,
+            sup_counter_bf=sup_counter_bf,
+            return_keys=file_idx == len(csv_names) - 1,
+        )
+        sup_counter_bf = counter_bf
+    return thres_keys
+
+
+_shard_state = {}
+
+
+def _init_count_keys_shard(counter_bf, sup_counter_bf, candidate_thres, chunk_size):
+    _shard_state.update(
+        template_bf=counter_bf,
+        sup_counter_bf=sup_counter_bf,
+        candidate_thres=candidate_thres,
+        chunk_size=chunk_size,
+        counter_bf=None,
+        candidate_keys=set(),
+    )
+
+
+def _count_keys_shard(csv_name, start, end):
+    # Один фильтр на процесс: все его части складываются в него
+    if _shard_state['counter_bf'] is None:
+        _shard_state['counter_bf'] = _shard_state['template_bf'].copy()
+    counter_bf = _shard_state['counter_bf']
+    sup_counter_bf = _shard_state['sup_counter_bf']
+    candidate_thres = _shard_state['candidate_thres']
+    candidate_keys = _shard_state['candidate_keys']
+
+    for keys_batch in read_key_batches(csv_name, start, end, _shard_state['chunk_size']):
+        keys_batch = HashedKeys(keys_batch, counter_bf.seed)
+        if sup_counter_bf is not None:
+            sup_keys = keys_batch if sup_counter_bf.seed == counter_bf.seed else keys_batch.keys
+            keys_batch = keys_batch[sup_counter_bf.get_many(sup_keys)]
+        if not len(keys_batch):
+            continue
+        counter_bf.put_many(keys_batch)
+        if candidate_thres is not None:
+            key_counts = counter_bf.count_many(keys_batch)
+            candidate_keys.update(key.decode() for key, count in zip(keys_batch.keys, key_counts) if count >= candidate_thres)
+
+
+def _count_keys_result():
+    result = _shard_state['counter_bf'], _shard_state['candidate_keys']
+    _shard_state.update(counter_bf=None, candidate_keys=set())
+    return result
+
+
+def count_keys_parallel(csv_name, counter_bf: ConutersBloomFilter,
+                        sup_counter_bf: ConutersBloomFilter = None,
+                        return_keys: bool = False,
+                        workers: int = None,
+                        shards_num: int = None,
+                        chunk_size: int = 1 << 20) -> set:
+    """
+    Параллельный аналог count_keys по csv файлу
+
+    Файл делится на части по границам строк, части считаются в пуле процессов - у каждого процесса
+    свой фильтр на все его части, затем фильтры процессов складываются в counter_bf.
+    Итоговый фильтр совпадает с фильтром последовательного count_keys.
+
+    Если ключ встречается не меньше count_thres раз во всём файле, то хотя бы у одного из процессов
+    он встречается не меньше count_thres / кол-во процессов раз - такие ключи процессы возвращают как кандидатов,
+    а окончательная проверка делается по сложенному фильтру.
+    Поэтому все действительно частые ключи в результате есть, но ложных срабатываний может быть больше,
+    чем у count_keys: тот проверяет ключ сразу после вставки, а здесь - по фильтру всего файла,
+    где счётчики ключа могли вырасти из-за коллизий с ключами, добавленными позже
+    """
+    shards_num = shards_num or default_shards_num(workers)
+    # Процессов может оказаться меньше, если частей меньше - тогда порог кандидатов только ниже нужного
+    workers_num = default_workers_num(shards_num, workers)
+    candidate_thres = -(-counter_bf.count_thres // workers_num) if return_keys else None
+
+    template_bf = counter_bf.copy()
+    template_bf.clear()
+    shard_results = map_worker_shards(
+        csv_name,
+        _count_keys_shard,
+        _count_keys_result,
+        shards_num=shards_num,
+        workers=workers,
+        initializer=_init_count_keys_shard,
+        initargs=(template_bf, sup_counter_bf, candidate_thres, chunk_size),
+    )
+
+    candidate_keys = set()
+    for shard_counter_bf, shard_candidate_keys in shard_results:
+        if shard_counter_bf is not None:
+            counter_bf.merge(shard_counter_bf)
+        candidate_keys |= shard_candidate_keys
+
+    thres_keys = set()
+    if candidate_keys:
+        candidate_keys = list(candidate_keys)
+        for key, is_thres in zip(candidate_keys, counter_bf.get_many(candidate_keys)):
+            if is_thres:
+                thres_keys.add(key)
+                print('Add new key:', key)
+
+    return thres_keys
+
+
 if __name__ == '__main__':
     target_table_row_num = 10**6
 
@@ -112,17 +303,17 @@ if __name__ == '__main__':
 
     # Посчитаем кол-во ключей в первом файле с помощью ConutersBloomFilter
     first_key_iter = tqdm(
-        read_csv_keys('task5_1.csv'),
+        read_key_batches('task5_1.csv'),
         desc='Collect 1 file',
-        total=target_table_row_num
+        unit='batch'
     )
     count_keys(first_key_iter, counter_bf=file_1_counter_bf)
 
     # Пройдёмся по второму файлу, зафиксируем ключи, которые встречаются нужное количество раз и запомним их
     second_key_iter = tqdm(
-        read_csv_keys('task5_2.csv'), 
+        read_key_batches('task5_2.csv'),
         desc='Collect 2 file',
-        total=target_table_row_num
+        unit='batch'
     )
     second_thres_keys = count_keys(second_key_iter, counter_bf=file_2_counter_bf, sup_counter_bf=file_1_counter_bf, return_keys=True)
 
@@ -1,99 +1,328 @@
-from collections import defaultdict
-
+import numpy as np
 from tqdm.auto import tqdm
 
 from counter_bloom_filter import ConutersBloomFilter
+from count_sketch import CountSketchJoin
+from csv_keys import iter_key_batches, read_key_batches
+from fingerprint_counter import FingerprintCounter
+from hashing import HashedKeys
+from parallel import default_shards_num, map_file_shards, map_worker_shards
 
 
-def count_join_size(
-        table_1_keys, 
-        table_2_keys, 
-        saved_1_table_keys,  # Сохранять ключи можно в процессе работы алгоритма, для упрощения просто пройдёмся по файлу заново
-        unique_key_thres = 10**6,  # Макс. кол-во уникальных ключей для точного метода,
-        join_row_thres = 10**7,  # Макс. кол-во строк в join, после которого перестаём считать
-        max_unique_key_size = 10**8  # Мах. кол-во уникальных ключей
-        ):
-    
+def make_join_counter_bf(max_unique_key_size: int) -> ConutersBloomFilter:
     hash_num = 4
     filter_size = max_unique_key_size  # Мах. кол-во уникальных ключей
     counter_num = 15  # Размер счётчика исходя из того, что каждый ключ повторяется ~10 раз
 
-    # Фильтры дл неточного подсчета
-    table_1_counter_bf = ConutersBloomFilter(
-        hash_num=hash_num,
-        filter_size=filter_size,
-        counter_num=counter_num,
-    )
-    table_2_counter_bf = ConutersBloomFilter(
+    return ConutersBloomFilter(
         hash_num=hash_num,
         filter_size=filter_size,
         counter_num=counter_num,
     )
-    # Словарь для точного подсчета
-    table_1_count_dict = defaultdict(lambda: 0)
-    table_2_count_dict = defaultdict(lambda: 0)
 
-    # Пройдёмся по каждому ключу из 2 таблиц
+
+def count_join_size(
+        table_1_keys, 
+        table_2_keys, 
+        saved_1_table_keys,  # Сохранять ключи можно в процессе работы алгоритма, для упрощения просто пройдёмся по файлу заново
+        unique_key_thres = 10**7,  # Макс. кол-во уникальных ключей для точного метода,
+        join_row_thres = 10**7,  # Макс. кол-во строк в join, после которого перестаём считать
+        max_unique_key_size = 10**8,  # Мах. кол-во уникальных ключей
+        batch_size = 10**4,
+        ):
+    """ Ключи таблиц - поток ключей или их батчей, например из read_key_batches """
+    # Фильтры дл неточного подсчета
+    table_1_counter_bf = make_join_counter_bf(max_unique_key_size)
+    table_2_counter_bf = make_join_counter_bf(max_unique_key_size)
+    hash_num = table_2_counter_bf.hash_num
+    # Счётчики отпечатков ключей для точного подсчета (~12 байт на ячейку вместо строки в словаре)
+    table_1_key_counter = FingerprintCounter()
+    table_2_key_counter = FingerprintCounter()
+
+    # Пройдёмся по ключам из 2 таблиц батчами
     keys_enable = True
-    table_1_key_iter = iter(table_1_keys)
-    table_2_key_iter = iter(table_2_keys)
+    table_1_batch_iter = iter_key_batches(table_1_keys, batch_size)
+    table_2_batch_iter = iter_key_batches(table_2_keys, batch_size)
     p_bar = tqdm(desc='Process 1 and 2 file')
     while keys_enable:
         keys_enable = False
 
-        for key_iter, counter_bf, counter_dict in zip(
-            [table_1_key_iter, table_2_key_iter],
+        for batch_iter, counter_bf, key_counter in zip(
+            [table_1_batch_iter, table_2_batch_iter],
             [table_1_counter_bf, table_2_counter_bf],
-            [table_1_count_dict, table_2_count_dict]
+            [table_1_key_counter, table_2_key_counter]
         ):
-            try:
-                # Получим ключ первой таблицы
-                key = next(key_iter)
-                keys_enable = True
-                # Запомним ключ для приблизительного подсчета
-                counter_bf.put(key)
-                if counter_dict is not None:
-                    # Запомним ключ для точного подсета
-                    counter_dict[key] += 1
-            except StopIteration:
-                pass
+            keys_batch = next(batch_iter, None)
+            if keys_batch is None:
+                continue
+            keys_enable = True
+            # Хешируем батч один раз для фильтра и счётчика
+            keys_batch = HashedKeys(keys_batch, counter_bf.seed)
+            # Запомним ключи для приблизительного подсчета
+            counter_bf.put_many(keys_batch)
+            if key_counter is not None:
+                # Запомним ключи для точного подсчета
+                key_counter.put_many(keys_batch)
+            p_bar.update(len(keys_batch))
 
-        # Если уникальных ключей больше порога - удалим точную реализацию
-        if table_1_count_dict is not None and any(len(c_dict) > unique_key_thres for c_dict in [table_1_count_dict, table_2_count_dict]):
-            table_1_count_dict = None
-            table_2_count_dict = None
-        
-        p_bar.update(1)
+        # Если уникальных ключей больше порога - удалим точную реализацию.
+        # Кол-во уникальных ключей только растёт, поэтому проверка после батча даёт то же решение, что и после строки
+        if table_1_key_counter is not None and any(len(k_counter) > unique_key_thres for k_counter in [table_1_key_counter, table_2_key_counter]):
+            table_1_key_counter = None
+            table_2_key_counter = None
 
     join_row_counts = 0
     # Если точная реализация
-    if table_1_count_dict is not None:
+    if table_1_key_counter is not None:
         print('Use accurate algorythm')
-        # Пройдёмся по значениям первой таблицы
-        for key, table_1_key_count in table_1_count_dict.items():
-            # Получим соответствующее значение второй таблицы
-            table_2_key_count = table_2_count_dict[key]
-            # Перемножим значения для получения кол-ва строк по данному ключу
-            join_row_counts += table_1_key_count * table_2_key_count
+        # Сумма произведений кол-в общих ключей двух таблиц
+        join_row_counts = table_1_key_counter.join_size(table_2_key_counter)
     # Если неточная реализация
     else:
         print('Use non-accurate algorythm')
         # Заново пройдёмся по всем ключам из одного из файла
-        saved_1_table_key_iter = tqdm(saved_1_table_keys, desc='Counting JSON rows by non-accurate algorythm')
-        for key in saved_1_table_key_iter:
+        saved_1_table_batch_iter = tqdm(
+            iter_key_batches(saved_1_table_keys, batch_size),
+            desc='Counting JSON rows by non-accurate algorythm',
+            unit='batch'
+        )
+        for keys_batch in saved_1_table_batch_iter:
             # Получим значение встречаемости во втором файле
-            # как среднее значение счётчиков и поделим на количество хешей -> Примерное кол-во одинаковых комбинаций
-            counter_idxes = table_2_counter_bf.hash(key)
-            table_2_comb_count = int(
-                min(table_2_counter_bf._get_counter(c_idx) for c_idx in counter_idxes) / hash_num
-            )
-            # Перемножим соответствующие значения комбинаций (каждый счетчик отвечает за свой ключ)        
-            join_row_counts += table_2_comb_count
-            # Если значения строк больше порога - перестанем считать
-            if join_row_counts > join_row_thres:
+            # как минимальное значение счётчиков и поделим на количество хешей -> Примерное кол-во одинаковых комбинаций
+            table_2_comb_counts = table_2_counter_bf.count_many(keys_batch) // hash_num
+            # Перемножим соответствующие значения комбинаций (каждый счетчик отвечает за свой ключ)
+            batch_join_row_counts = join_row_counts + np.cumsum(table_2_comb_counts, dtype=np.int64)
+            # Если значения строк больше порога - перестанем считать на том же ключе, что и при проходе по одному
+            over_thres_idxes = np.flatnonzero(batch_join_row_counts > join_row_thres)
+            if len(over_thres_idxes):
+                join_row_counts = int(batch_join_row_counts[over_thres_idxes[0]])
                 print(f'JOIN rows > {join_row_thres}')
                 break
+            if len(batch_join_row_counts):
+                join_row_counts = int(batch_join_row_counts[-1])
     
     # Вернём значение строк
     return join_row_counts
-            
\ No newline at end of file
+
+
+def count_join_size_sketch(
+        table_1_keys,
+        table_2_keys,
+        unique_key_thres = 10**7,  # Макс. кол-во уникальных ключей для точного метода,
+        join_row_thres = 10**7,  # Макс. кол-во строк в join, после которого перестаём считать
+        sketch_width = 1 << 16,  # Кол-во счётчиков в строке count sketch
+        sketch_depth = 5,  # Кол-во строк count sketch
+        batch_size = 10**4,
+        ) -> tuple[int, float]:
+    """
+    Размер JOIN за один проход без повторного чтения первой таблицы
+
+    Ключи таблиц, как и в count_join_size, - поток ключей или их батчей, например из read_key_batches.
+
+    Пока уникальных ключей мало, кол-ва считаются точно, как в count_join_size. Параллельно для каждой таблицы
+    ведётся count sketch (Fast-AGMS), и при отказе от точного метода размер JOIN оценивается
+    скалярным произведением скетчей - несмещённо, в отличие от минимума счётчиков фильтра.
+    Возвращает размер JOIN и стандартное отклонение оценки (0 для точного метода).
+    Как только оценка превышает join_row_thres больше чем на 3 стандартных отклонения,
+    проход останавливается досрочно
+    """
+    join_sketch = CountSketchJoin(width=sketch_width, depth=sketch_depth)
+    table_1_key_counter = FingerprintCounter()
+    table_2_key_counter = FingerprintCounter()
+
+    table_1_batch_iter = iter_key_batches(table_1_keys, batch_size)
+    table_2_batch_iter = iter_key_batches(table_2_keys, batch_size)
+    p_bar = tqdm(desc='Process 1 and 2 file')
+    keys_enable = True
+    while keys_enable:
+        keys_enable = False
+        for table_idx, batch_iter, key_counter in zip(
+            [0, 1],
+            [table_1_batch_iter, table_2_batch_iter],
+            [table_1_key_counter, table_2_key_counter]
+        ):
+            keys_batch = next(batch_iter, None)
+            if keys_batch is None:
+                continue
+            keys_enable = True
+            keys_batch = HashedKeys(keys_batch, join_sketch.seed)
+            join_sketch.put_many(table_idx, keys_batch)
+            if key_counter is not None:
+                key_counter.put_many(keys_batch)
+            p_bar.update(len(keys_batch))
+
+        # Если уникальных ключей больше порога - удалим точную реализацию
+        if table_1_key_counter is not None and any(len(k_counter) > unique_key_thres for k_counter in [table_1_key_counter, table_2_key_counter]):
+            table_1_key_counter = None
+            table_2_key_counter = None
+
+        # Новые строки таблиц не уменьшают настоящий размер JOIN, поэтому уверенное превышение порога уже не исчезнет.
+        # Оценка ведётся скетчем на ходу, проверка после каждого батча стоит O(depth)
+        if table_1_key_counter is None:
+            join_row_counts = join_sketch.est_join_size()
+            join_row_std = join_sketch.join_std()
+            if join_row_counts - 3 * join_row_std > join_row_thres:
+                print(f'JOIN rows > {join_row_thres}')
+                return int(join_row_counts), join_row_std
+
+    if table_1_key_counter is not None:
+        print('Use accurate algorythm')
+        return table_1_key_counter.join_size(table_2_key_counter), 0.0
+
+    print('Use non-accurate algorythm')
+    join_row_counts = join_sketch.est_join_size()
+    join_row_std = join_sketch.join_std()
+    if join_row_counts > join_row_thres:
+        print(f'JOIN rows > {join_row_thres}')
+    return int(join_row_counts), join_row_std
+
+    if table_1_key_counter is not None:
+        print('Use accurate algorythm')
+        return table_1_key_counter.join_size(table_2_key_counter), 0.0
+
+    print('Use non-accurate algorythm')
+    join_row_counts = table_1_sketch.est_join_size(table_2_sketch)
+    join_row_std = table_1_sketch.join_std(table_2_sketch)
+    if join_row_counts > join_row_thres:
+        print(f'JOIN rows > {join_row_thres}')
+    return int(join_row_counts), join_row_std
+
+
+_shard_state = {}
+
+
+def _init_join_shard(counter_bf, unique_key_thres, join_row_thres, chunk_size):
+    _shard_state.update(
+        template_bf=counter_bf,
+        unique_key_thres=unique_key_thres,
+        join_row_thres=join_row_thres,
+        chunk_size=chunk_size,
+        counter_bf=None,
+        key_counter=None,
+        is_started=False,
+    )
+
+
+def _collect_join_shard(csv_name, start, end):
+    # Один фильтр и счётчик ключей на процесс: все его части складываются в них
+    if not _shard_state['is_started']:
+        template_bf = _shard_state['template_bf']
+        _shard_state.update(
+            counter_bf=template_bf.copy() if template_bf is not None else None,
+            key_counter=FingerprintCounter(),
+            is_started=True,
+        )
+    counter_bf = _shard_state['counter_bf']
+    key_counter = _shard_state['key_counter']
+
+    for keys_batch in read_key_batches(csv_name, start, end, _shard_state['chunk_size']):
+        # Фильтр и счётчик с seed по умолчанию - хешируем батч один раз для обоих
+        keys_batch = HashedKeys(keys_batch)
+        if counter_bf is not None:
+            counter_bf.put_many(keys_batch)
+        if key_counter is not None:
+            key_counter.put_many(keys_batch)
+            # Если уникальных ключей больше порога - точная реализация не понадобится
+            if len(key_counter) > _shard_state['unique_key_thres']:
+                key_counter = None
+    _shard_state['key_counter'] = key_counter
+
+
+def _collect_join_result():
+    # Процесс без частей возвращает пустой результат, его точный счётчик не должен отменять точный метод
+    result = (_shard_state['counter_bf'], _shard_state['key_counter']) if _shard_state['is_started'] else None
+    _shard_state.update(counter_bf=None, key_counter=None, is_started=False)
+    return result
+
+
+def _count_join_rows_shard(csv_name, start, end):
+    # Здесь фильтр-шаблон - уже заполненный фильтр второй таблицы
+    counter_bf = _shard_state['template_bf']
+    join_row_counts = 0
+
+    for keys_batch in read_key_batches(csv_name, start, end, _shard_state['chunk_size']):
+        # Та же оценка, что и в count_join_size: минимальный счётчик, поделённый на кол-во хешей
+        table_2_comb_counts = counter_bf.count_many(keys_batch) // counter_bf.hash_num
+        join_row_counts += int(table_2_comb_counts.sum())
+        if join_row_counts > _shard_state['join_row_thres']:
+            break
+
+    return join_row_counts
+
+
+def _collect_join_table(csv_name, template_bf, unique_key_thres, workers, shards_num, chunk_size):
+    counter_bf = template_bf.copy() if template_bf is not None else None
+    key_counter = FingerprintCounter()
+    for shard_result in map_worker_shards(
+        csv_name,
+        _collect_join_shard,
+        _collect_join_result,
+        shards_num=shards_num,
+        workers=workers,
+        initializer=_init_join_shard,
+        initargs=(template_bf, unique_key_thres, None, chunk_size),
+    ):
+        if shard_result is None:
+            continue
+        shard_counter_bf, shard_key_counter = shard_result
+        if counter_bf is not None:
+            counter_bf.merge(shard_counter_bf)
+        if key_counter is not None and shard_key_counter is not None:
+            key_counter.merge(shard_key_counter)
+            if len(key_counter) > unique_key_thres:
+                key_counter = None
+        else:
+            key_counter = None
+
+    return counter_bf, key_counter
+
+
+def count_join_size_parallel(
+        table_1_csv,
+        table_2_csv,
+        unique_key_thres = 10**7,  # Макс. кол-во уникальных ключей для точного метода,
+        join_row_thres = 10**7,  # Макс. кол-во строк в join, после которого перестаём считать
+        max_unique_key_size = 10**8,  # Мах. кол-во уникальных ключей
+        workers = None,
+        shards_num = None,
+        chunk_size = 1 << 20,
+        ):
+    """
+    Параллельный аналог count_join_size по csv файлам таблиц
+
+    Части каждого файла считаются в пуле процессов - у каждого процесса свои фильтр и счётчик ключей на все его части,
+    которые затем складываются.
+    Точный метод выбирается при тех же условиях, что и в count_join_size (кол-во уникальных ключей только растёт,
+    поэтому проверка по итоговым счётчикам равносильна проверке после каждой строки).
+    Неточный метод проходит первую таблицу заново по частям; при превышении join_row_thres
+    возвращаемое значение может отличаться от последовательного, но тоже больше порога
+    """
+    shards_num = shards_num or default_shards_num(workers)
+    template_bf = make_join_counter_bf(max_unique_key_size)
+
+    # Неточный метод использует только фильтр второй таблицы, для первой его не строим
+    _, table_1_key_counter = _collect_join_table(
+        table_1_csv, None, unique_key_thres, workers, shards_num, chunk_size
+    )
+    table_2_counter_bf, table_2_key_counter = _collect_join_table(
+        table_2_csv, template_bf, unique_key_thres, workers, shards_num, chunk_size
+    )
+
+    join_row_counts = 0
+    if table_1_key_counter is not None and table_2_key_counter is not None:
+        print('Use accurate algorythm')
+        join_row_counts = table_1_key_counter.join_size(table_2_key_counter)
+    else:
+        print('Use non-accurate algorythm')
+        join_row_counts = sum(map_file_shards(
+            table_1_csv,
+            _count_join_rows_shard,
+            shards_num=shards_num,
+            workers=workers,
+            initializer=_init_join_shard,
+            initargs=(table_2_counter_bf, unique_key_thres, join_row_thres, chunk_size),
+        ))
+        if join_row_counts > join_row_thres:
+            print(f'JOIN rows > {join_row_thres}')
+
+    return join_row_counts
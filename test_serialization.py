@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+
+from bloom_filter import BloomFilter
+from bloom_filter_n_hash import BloomFilterNHash
+from count_min_sketch import CountMinSketch
+from count_sketch import CountSketch
+from counter_bloom_filter import ConutersBloomFilter
+from cuckoo_filter import CuckooFilter
+from hyper_log_log import HyperLogLog
+from hyper_log_log_plus_plus import HyperLogLogPlusPlus
+from serialization import load, save
+from sliding_hyper_log_log import SlidingHyperLogLog
+from windowed_bloom_filter import WindowedBloomFilter
+
+KEYS = [f'key_{i}' for i in range(1000)]
+
+SKETCHES = {
+    'BloomFilter': (lambda: BloomFilter(10000), 'put_many', 'put'),
+    'BloomFilterNHash': (lambda: BloomFilterNHash(3, 10000), 'put_many', 'put'),
+    'ConutersBloomFilter': (lambda: ConutersBloomFilter(3, 10000, 15), 'put_many', 'put'),
+    'ConutersBloomFilter compact': (lambda: ConutersBloomFilter(3, 10000, 15, counter_bits=2), 'put_many', 'put'),
+    'CuckooFilter': (lambda: CuckooFilter(2000), 'put_many', 'put'),
+    'CountMinSketch': (lambda: CountMinSketch(1000, 3), 'put_many', 'put'),
+    'CountSketch': (lambda: CountSketch(1000), 'put_many', 'put'),
+    'HyperLogLog': (lambda: HyperLogLog(10, 64), 'add_many', 'put'),
+    'HyperLogLogPlusPlus': (lambda: HyperLogLogPlusPlus(4), 'add_many', 'put'),
+    'SlidingHyperLogLog': (lambda: SlidingHyperLogLog(10, 3, 60), 'add_many', 'put'),
+    'WindowedBloomFilter': (lambda: WindowedBloomFilter(3, 10000, 3, 60), 'put_many', 'put'),
+}
+
+
+@pytest.mark.parametrize('name', SKETCHES)
+def test_read_only_load_rejects_writes(name, tmp_path):
+    make_sketch, put_many_name, put_name = SKETCHES[name]
+    sketch = make_sketch()
+    getattr(sketch, put_many_name)(KEYS)
+    file_name = str(tmp_path / 'sketch.sk')
+    save(sketch, file_name)
+
+    loaded = load(file_name, mmap_mode='r')
+    # ufunc.at на отображении только для чтения ронял процесс - теперь это ValueError
+    with pytest.raises(ValueError, match='read-only'):
+        getattr(loaded, put_many_name)(['new_key_1', 'new_key_2'])
+    with pytest.raises(ValueError, match='read-only'):
+        getattr(loaded, put_name)('new_key_3')
+
+
+@pytest.mark.parametrize('name', SKETCHES)
+def test_copy_on_write_load_is_writable(name, tmp_path):
+    make_sketch, put_many_name, _ = SKETCHES[name]
+    sketch = make_sketch()
+    getattr(sketch, put_many_name)(KEYS)
+    file_name = str(tmp_path / 'sketch.sk')
+    save(sketch, file_name)
+
+    loaded = load(file_name, verify=True)
+    getattr(loaded, put_many_name)(['new_key'])
+    # Изменения копии не попадают в файл
+    reloaded = load(file_name, mmap_mode='r')
+    if hasattr(sketch, 'get_many'):
+        assert np.array_equal(reloaded.get_many(KEYS), sketch.get_many(KEYS))
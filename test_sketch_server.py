@@ -0,0 +1,81 @@
+import asyncio
+
+import pytest
+
+from sketch_server import SketchClient, SketchServer, decode_keys, encode_keys
+
+
+def run_with_client(scenario, pool_size: int = 2):
+    """ Поднимает сервер на свободном порту и выполняет scenario(client) """
+    async def main():
+        server = await SketchServer().start(port=0)
+        port = server.sockets[0].getsockname()[1]
+        try:
+            async with SketchClient(port=port, pool_size=pool_size) as client:
+                return await scenario(client)
+        finally:
+            server.close()
+            await server.wait_closed()
+
+    return asyncio.run(main())
+
+
+def test_create_put_get_estimate_metrics():
+    keys = [f'key_{i}' for i in range(1000)]
+
+    async def scenario(client):
+        await client.create('seen', 'BloomFilterNHash', hash_num=4, filter_size=1 << 16)
+        await client.create('hll', 'HyperLogLogPlusPlus', b=12)
+        for start in range(0, len(keys), 100):
+            await client.put_many('seen', keys[start:start + 100])
+        await client.put_many('hll', keys)
+        return (
+            await client.get_many('seen', [*keys[:10], 'missing_key']),
+            await client.estimate('hll'),
+            await client.metrics(),
+            await client.list(),
+        )
+
+    found, estimate, metrics, sketches = run_with_client(scenario)
+    assert found.tolist() == [True] * 10 + [False]
+    assert estimate == pytest.approx(len(keys), rel=0.05)
+    assert sketches == {'seen': 'BloomFilterNHash', 'hll': 'HyperLogLogPlusPlus'}
+    assert metrics['seen']['keys_total'] == len(keys)
+    assert metrics['seen']['batches_total'] == 10
+    assert metrics['seen']['queries_total'] == 1
+    assert sum(metrics['seen']['batch_latency_ms']['counts']) == 10
+    assert 0 < metrics['seen']['fill_ratio'] < 1
+    assert metrics['hll']['keys_total'] == len(keys)
+
+
+def test_error_response_keeps_connection():
+    async def scenario(client):
+        with pytest.raises(RuntimeError, match='TypeError: Unsupported sketch type'):
+            await client.create('bad', 'NoSuchSketch')
+        with pytest.raises(RuntimeError, match="KeyError: .*'missing'"):
+            await client.put_many('missing', ['key'])
+        # Ошибка запроса не закрывает соединение - следующий запрос идёт по нему же
+        await client.create('counts', 'CountMinSketch', width=1000, depth=3)
+        await client.put_many('counts', ['a', 'a', 'b'])
+        return await client.count_many('counts', ['a', 'b', 'c'])
+
+    assert run_with_client(scenario, pool_size=1).tolist() == [2, 1, 0]
+
+
+def test_keys_batch_with_empty_and_separator_keys():
+    keys = ['', 'a,b', 'line\nbreak', '', 'plain']
+    assert decode_keys(encode_keys(keys)) == [key.encode() for key in keys]
+    assert decode_keys(encode_keys([])) == []
+    with pytest.raises(ValueError):
+        decode_keys(encode_keys(keys)[:-1])
+
+    async def scenario(client):
+        await client.create('seen', 'BloomFilterNHash', hash_num=4, filter_size=1 << 16)
+        await client.put_many('seen', keys)
+        await client.put_many('seen', [])
+        metrics = await client.metrics('seen')
+        return await client.get_many('seen', [*keys, 'a', 'line']), metrics
+
+    found, metrics = run_with_client(scenario)
+    assert found.tolist() == [True] * len(keys) + [False, False]
+    assert metrics['seen']['keys_total'] == len(keys)
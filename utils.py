@@ -1,5 +1,10 @@
+import os
 import uuid
 import random
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
 from tqdm import tqdm
 
 
@@ -45,6 +50,8 @@ def gen_grouped_seq(name, pattern, *, n_extra_cols=0, to_shuffle=False):
     набор и перемешать записи - это не взлетит.
 
     На такой случай придумана функция `random_merge`. Создайте несколько перемешанных кусков в файлах, а потом смешайте
+
+    Для наборов в сотни миллионов строк и больше есть `gen_grouped_seq_fast` - она делает это сама, параллельно
     """
 
     def gen():
@@ -74,17 +81,226 @@ def random_merge(out_name, *in_names):
     """
     Случайно перемешивает заданные входные файлы.
 
-    known issue: при входных файлах сильно разной длины случайность перемешивания сомнительна
-    (если это важно, проще входные файлы подровнять по длине, чем адаптировать код под такую ситуацию)
+    Следующая строка берётся из файла с вероятностью, пропорциональной числу оставшихся в нём строк -
+    так все порядки чередования файлов равновероятны и при входных файлах разной длины.
+    Для этого файлы сначала один раз просматриваются, чтобы посчитать строки
     """
+    remaining = []
+    for fn in in_names:
+        with open(fn, "rb") as f:
+            remaining.append(sum(1 for _ in f))
 
     fs = [open(fn, "rt") for fn in in_names]
     with open(out_name, "wt") as fout:
-        while fs:
-            f = random.choice(fs)
-            s = f.readline()
-            if not s:
-                f.close()
-                fs.remove(f)
-                continue
-            print(s, file=fout, end="")
+        while any(remaining):
+            file_idx = random.choices(range(len(fs)), weights=remaining)[0]
+            remaining[file_idx] -= 1
+            print(fs[file_idx].readline(), file=fout, end="")
+    for f in fs:
+        f.close()
+
+
+# Шестнадцатеричные цифры как байты - для перевода случайных байтов в текст таблицей
+_HEX_DIGITS = np.frombuffer(b"0123456789abcdef", dtype=np.uint8)
+# Строк в одном куске записи: ограничивает память под текст куска
+_WRITE_CHUNK_ROWS = 1 << 18
+
+
+def _splitmix64(values: np.ndarray) -> np.ndarray:
+    """ Финализатор SplitMix64 - биекция uint64, поэтому разные номера дают разные значения """
+    z = values + np.uint64(0x9E3779B97F4A7C15)
+    z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return z ^ (z >> np.uint64(31))
+
+
+def _hex_columns(data: np.ndarray) -> np.ndarray:
+    """ Байты формы (n, k) -> шестнадцатеричный текст формы (n, 2k) """
+    hex_text = np.empty((data.shape[0], data.shape[1] * 2), dtype=np.uint8)
+    hex_text[:, 0::2] = _HEX_DIGITS[data >> 4]
+    hex_text[:, 1::2] = _HEX_DIGITS[data & 15]
+    return hex_text
+
+
+def _run_line_size(run, key_bytes, n_extra_cols, extra_bytes):
+    """ Длина строк куска: у именованного ключа она своя, у порождённых - 2 * key_bytes """
+    first_key = run[0][0]
+    key_size = len(first_key) if isinstance(first_key, bytes) else 2 * key_bytes
+    return key_size + n_extra_cols * (1 + 2 * extra_bytes) + 1
+
+
+def _plan_runs(pattern, run_rows):
+    """
+    Делит шаблон на куски не больше run_rows строк
+
+    Кусок - список отрезков (номер первой группы, кол-во групп, строк в группе);
+    группа больше куска делится между несколькими кусками, номер группы у частей общий.
+    Именованный ключ (строка вместо кол-ва групп) получает свои куски из одного отрезка (ключ в bytes, 1, строк),
+    чтобы все строки куска были одной длины
+    """
+    runs, run, run_size = [], [], 0
+    group_id = 0
+    for n_keys, n_records in pattern:
+        if isinstance(n_keys, (str, bytes)):
+            key = n_keys.encode() if isinstance(n_keys, str) else n_keys
+            if not key or any(char in key for char in b",\r\n"):
+                raise ValueError(f"Named key must be non-empty and contain no ',' or line breaks, got {n_keys!r}")
+            # Незаполненный кусок закрывается, чтобы без перемешивания строки шли в порядке шаблона
+            if run:
+                runs.append(run)
+                run, run_size = [], 0
+            for start in range(0, n_records, run_rows):
+                runs.append([(key, 1, min(run_rows, n_records - start))])
+            continue
+        groups_left = n_keys
+        while groups_left:
+            free_rows = run_rows - run_size
+            if n_records <= free_rows:
+                groups_num = min(groups_left, free_rows // n_records)
+                run.append((group_id, groups_num, n_records))
+                group_id += groups_num
+                groups_left -= groups_num
+                run_size += groups_num * n_records
+            else:
+                records_left = n_records
+                while records_left:
+                    records_num = min(run_rows - run_size, records_left)
+                    run.append((group_id, 1, records_num))
+                    run_size += records_num
+                    records_left -= records_num
+                    if run_size == run_rows:
+                        runs.append(run)
+                        run, run_size = [], 0
+                group_id += 1
+                groups_left -= 1
+            if run_size == run_rows:
+                runs.append(run)
+                run, run_size = [], 0
+    if run:
+        runs.append(run)
+    return runs
+
+
+def _write_grouped_run(file_name, offset, segments, key_salts, seed_seq, key_bytes, n_extra_cols, extra_bytes, to_shuffle):
+    """ Порождает строки одного куска и пишет их в file_name с байта offset """
+    rng = np.random.default_rng(seed_seq)
+    named_key = segments[0][0] if isinstance(segments[0][0], bytes) else None
+    if named_key is not None:
+        # Кусок именованного ключа - один отрезок, ключ пишется как есть
+        group_ids = np.zeros(segments[0][2], dtype=np.uint64)
+        named_key = np.frombuffer(named_key, dtype=np.uint8)
+    else:
+        group_ids = np.concatenate([
+            np.repeat(np.arange(first_group, first_group + groups_num, dtype=np.uint64), n_records)
+            for first_group, groups_num, n_records in segments
+        ])
+        if to_shuffle:
+            rng.shuffle(group_ids)
+
+    with open(file_name, "r+b") as f:
+        f.seek(offset)
+        for start in range(0, len(group_ids), _WRITE_CHUNK_ROWS):
+            chunk_ids = group_ids[start:start + _WRITE_CHUNK_ROWS]
+            if named_key is not None:
+                columns = [np.broadcast_to(named_key, (len(chunk_ids), len(named_key)))]
+            else:
+                # Первое слово ключа - биекция номера группы, поэтому ключи разных групп не совпадают
+                key_words = np.stack([_splitmix64(chunk_ids ^ salt) for salt in key_salts], axis=1)
+                key_data = key_words.astype(">u8").view(np.uint8).reshape(len(chunk_ids), -1)[:, :key_bytes]
+                columns = [_hex_columns(key_data)]
+            for _ in range(n_extra_cols):
+                columns.append(np.full((len(chunk_ids), 1), ord(","), dtype=np.uint8))
+                extra = np.frombuffer(rng.bytes(len(chunk_ids) * extra_bytes), dtype=np.uint8)
+                columns.append(_hex_columns(extra.reshape(len(chunk_ids), extra_bytes)))
+            columns.append(np.full((len(chunk_ids), 1), ord("\n"), dtype=np.uint8))
+            f.write(np.concatenate(columns, axis=1).tobytes())
+
+
+def _merge_runs(out_name, run_names, run_rows, line_sizes, rng):
+    """
+    Несмещённое внешнее слияние перемешанных кусков
+
+    Каждая следующая строка берётся из куска с вероятностью, пропорциональной числу оставшихся в нём строк,
+    т.е. порядок кусков - равновероятная перестановка мультимножества их номеров.
+    Для блока из _WRITE_CHUNK_ROWS строк сразу разыгрывается, сколько строк даст каждый кусок
+    (многомерное гипергеометрическое распределение), и эти номера перемешиваются внутри блока.
+    Строки разных кусков могут отличаться длиной (line_sizes - длина строк каждого куска)
+    """
+    remaining = np.array(run_rows, dtype=np.int64)
+    line_sizes = np.array(line_sizes, dtype=np.int64)
+    max_line_size = int(line_sizes.max(initial=0))
+    run_files = [open(run_name, "rb") for run_name in run_names]
+    with open(out_name, "wb") as fout:
+        while remaining.sum():
+            block_rows = int(min(_WRITE_CHUNK_ROWS, remaining.sum()))
+            block_counts = rng.multivariate_hypergeometric(remaining, block_rows)
+            run_labels = np.repeat(np.arange(len(run_files)), block_counts)
+            rng.shuffle(run_labels)
+            # Строки блока лежат в строках матрицы шириной в самую длинную строку, хвосты коротких отбрасываются
+            block = np.empty((block_rows, max_line_size), dtype=np.uint8)
+            for run_idx in np.flatnonzero(block_counts):
+                line_size = int(line_sizes[run_idx])
+                run_lines = run_files[run_idx].read(int(block_counts[run_idx]) * line_size)
+                block[run_labels == run_idx, :line_size] = np.frombuffer(run_lines, dtype=np.uint8).reshape(-1, line_size)
+            remaining -= block_counts
+            row_sizes = line_sizes[run_labels]
+            if (row_sizes == max_line_size).all():
+                fout.write(block.tobytes())
+            else:
+                fout.write(block[np.arange(max_line_size) < row_sizes[:, None]].tobytes())
+    for run_file in run_files:
+        run_file.close()
+
+
+def gen_grouped_seq_fast(name, pattern, *, n_extra_cols=0, to_shuffle=False, seed=0,
+                         workers=None, run_rows=1 << 22, key_bytes=16, extra_bytes=16, tmp_dir=None):
+    """
+    Быстрый аналог `gen_grouped_seq` для больших наборов: тот же шаблон (n_keys, n_records),
+    результат полностью определяется seed
+
+    Ключ группы - key_bytes байтов в шестнадцатеричном виде, его первые 8 байтов - биекция номера группы,
+    поэтому ключи разных групп гарантированно различны. Дополнительные колонки - случайные extra_bytes байтов.
+    Как и в `gen_grouped_seq`, вместо кол-ва групп можно указать ключ строкой, например ('key_1', 5) -
+    это одна группа, ключ пишется как есть (без запятых и переводов строк).
+    Строки куска одной длины, поэтому шаблон делится на куски по run_rows строк, и процессы пишут
+    свои куски сразу на нужное место файла.
+
+    При `to_shuffle=True` куски перемешиваются в памяти процессов и пишутся во временные файлы (в tmp_dir),
+    а затем сливаются без смещения (см. `_merge_runs`) - память нужна только на кусок, а не на весь набор
+    """
+    if key_bytes < 8:
+        raise ValueError(f"key_bytes must be at least 8 to keep keys unique, got {key_bytes}")
+    seed_seq = np.random.SeedSequence(seed)
+    # Соль на каждое 8-байтовое слово ключа; лишние байты последнего слова отбрасываются
+    key_salts = seed_seq.generate_state(-(-key_bytes // 8), dtype=np.uint64)
+    runs = _plan_runs(pattern, run_rows)
+    run_sizes = [sum(groups_num * n_records for _, groups_num, n_records in run) for run in runs]
+    line_sizes = [_run_line_size(run, key_bytes, n_extra_cols, extra_bytes) for run in runs]
+    run_bytes = [run_size * line_size for run_size, line_size in zip(run_sizes, line_sizes)]
+    run_seeds = seed_seq.spawn(len(runs) + 1)
+
+    with tempfile.TemporaryDirectory(dir=tmp_dir) as run_dir:
+        if to_shuffle:
+            run_names = [os.path.join(run_dir, f"run_{run_idx}.txt") for run_idx in range(len(runs))]
+            run_offsets = [0] * len(runs)
+        else:
+            run_names = [name] * len(runs)
+            run_offsets = np.cumsum([0, *run_bytes[:-1]])
+        # Файлы создаются заранее нужного размера, чтобы процессы писали в них по смещениям
+        for file_name, file_size in (zip(run_names, run_bytes) if to_shuffle else [(name, sum(run_bytes))]):
+            with open(file_name, "wb") as f:
+                f.truncate(file_size)
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(
+                    _write_grouped_run, run_name, int(offset), run, key_salts, run_seed,
+                    key_bytes, n_extra_cols, extra_bytes, to_shuffle,
+                )
+                for run_name, offset, run, run_seed in zip(run_names, run_offsets, runs, run_seeds)
+            ]
+            for future in tqdm(futures, desc="runs"):
+                future.result()
+
+        if to_shuffle:
+            _merge_runs(name, run_names, run_sizes, line_sizes, np.random.default_rng(run_seeds[-1]))
@@ -0,0 +1,69 @@
+from typing import Optional
+
+import numpy as np
+
+from bit_array import popcount
+from bloom_filter_n_hash import BloomFilterNHash
+from generation_ring import GenerationRing
+from hashing import Keys, hashed_keys
+
+
+class WindowedBloomFilter:
+    """
+    Bloom-фильтр по скользящему окну времени: кольцо поколений (GenerationRing) из фильтров BloomFilterNHash
+
+    Ключ кладётся в фильтр своего поколения, запрос - OR по живым поколениям, т.е. по последним generations,
+    включая текущее. Все поколения одного размера и seed - позиции батча ключей считаются один раз для всех
+    """
+    def __init__(
+            self,
+            hash_num: int,
+            filter_size: int,
+            generations: int,
+            generation_span: float,
+            seed: int = 0
+            ):
+        self.ring = GenerationRing(generations, generation_span)
+        self.hash_num = hash_num
+        self.filter_size = filter_size
+        self.seed = seed
+        self.filters = [BloomFilterNHash(hash_num, filter_size, seed) for _ in range(generations)]
+
+    def _clear_filter(self, slot: int):
+        self.filters[slot].is_hashed[:] = 0
+        self.filters[slot]._ones_count = 0
+
+    def _put_filter(self, now: Optional[float]) -> Optional[BloomFilterNHash]:
+        slot = self.ring.put_slot(now, self._clear_filter)
+        return None if slot is None else self.filters[slot]
+
+    def _live_filters(self, now: Optional[float]) -> list[BloomFilterNHash]:
+        return [self.filters[slot] for slot in self.ring.live_slots(now)]
+
+    def put(self, string: str, now: Optional[float] = None):
+        bloom_filter = self._put_filter(now)
+        if bloom_filter is not None:
+            bloom_filter.put(string)
+
+    def get(self, string: str, now: Optional[float] = None) -> bool:
+        return any(bloom_filter.get(string) for bloom_filter in self._live_filters(now))
+
+    def put_many(self, strings: Keys, now: Optional[float] = None):
+        bloom_filter = self._put_filter(now)
+        if bloom_filter is not None:
+            bloom_filter.put_many(strings)
+
+    def get_many(self, strings: Keys, now: Optional[float] = None) -> np.ndarray:
+        strings = hashed_keys(strings, self.seed)
+        result = np.zeros(len(strings), dtype=bool)
+        for bloom_filter in self._live_filters(now):
+            result |= bloom_filter.get_many(strings)
+        return result
+
+    def size(self, now: Optional[float] = None) -> float:
+        """ Кол-во единиц объединения живых поколений, делённое на кол-во хешей """
+        live_filters = self._live_filters(now)
+        if not live_filters:
+            return 0.0
+        union_cells = np.bitwise_or.reduce([bloom_filter.is_hashed for bloom_filter in live_filters])
+        return popcount(union_cells) / self.hash_num